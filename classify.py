@@ -1,20 +1,25 @@
+import argparse
+import collections
 import json
 import os
-import re
-import MeCab
-import numpy as np
-import keras
-from keras.utils import np_utils
-from keras.models import Sequential, model_from_json
-from keras.layers import Dense
-from keras.preprocessing import sequence
-import collections
+import subprocess
+import sys
 
-# import gensim.parsing.preprocessing
-from gensim import corpora, matutils
-from sklearn.model_selection import train_test_split
+# keras, gensim, sklearn, MeCab は import が重いので、使う関数の中で import する
+from preprocess import clean_tweet, tokenize
 
 DIC_NAME = 'dic_raw_full4.txt'
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(PROJECT_DIR, 'data/processed')
+WORDS_PATH = os.path.join(DATA_DIR, 'words.json')
+LABEL_NAMES_PATH = os.path.join(DATA_DIR, 'label_names.json')
+MODEL_PATH = os.path.join(PROJECT_DIR, 'model/model_json1.json')
+ENGINE_PATH = os.path.join(PROJECT_DIR, 'model/classifier_{0}.npz')  # {0} は --first-layer (int8 か float16)
+VOCAB_PATH = os.path.join(PROJECT_DIR, 'dic', DIC_NAME + '.vocab.npy')
+SPLIT_PATH = os.path.join(DATA_DIR, 'split')
+RUNS_PATH = os.path.join(PROJECT_DIR, 'model/runs.jsonl')
+# `import classify` にかけてよい時間 (ミリ秒)
+IMPORT_TIME_BUDGET_MS = 100
 
 def load_json(data_dir):
     with open(os.path.join(data_dir, 'livedoor.json')) as f:
@@ -23,29 +28,7 @@ def load_json(data_dir):
 
 def clean_text(text):
     replaced_text = '\n'.join(s.strip() for s in text.splitlines()[2:] if s != '')  # skip header by [2:]
-    replaced_text = replaced_text.lower()
-    replaced_text = re.sub(r'[【】]', ' ', replaced_text)       # 【】の除去
-    replaced_text = re.sub(r'[（）()]', ' ', replaced_text)     # （）の除去
-    replaced_text = re.sub(r'[［］\[\]]', ' ', replaced_text)   # ［］の除去
-    replaced_text = re.sub(r'[@＠]\w+', '', replaced_text)  # メンションの除去
-    replaced_text = re.sub(r'https?:\/\/.*?[\r\n ]', '', replaced_text)  # URLの除去
-    replaced_text = re.sub(r'　', ' ', replaced_text)  # 全角空白の除去
-    return replaced_text
-
-def tokenize(text):
-    mecabTagger = MeCab.Tagger('mecal-ipadic-neologd')
-    word_list = []
-    res = mecabTagger.parseToNode(text)
-    while res:
-        pos = res.feature.split(",")
-        if pos[0] in ["名詞"]:
-            if not pos[1] in ["代名詞", "固有名詞", "数", "非自立", "特殊"]:
-                try:
-                    word_list.append(res.surface)
-                except UnicodeDecodeError:
-                    print('デコードエラー→'+pos[0]+pos[1]+pos[2])
-        res = res.next
-    return word_list
+    return clean_tweet(replaced_text)
 
 def make_words_list(data):
     words_list = [clean_text(text) for text in data]
@@ -53,6 +36,7 @@ def make_words_list(data):
     return words_list
 
 def load_dic(project_dir, words_list):
+    from gensim import corpora
     DIC_DIR = os.path.join(project_dir, 'dic', DIC_NAME)
     if not os.path.exists(DIC_DIR):
         dictionary = corpora.Dictionary(words_list)
@@ -61,23 +45,69 @@ def load_dic(project_dir, words_list):
     dic = corpora.Dictionary.load_from_text(DIC_DIR)
     return dic
 
-def make_data_set(words_list, dic):
+def load_vocab(words_list=None, vocab_path=None):
+    # vocab_path を指定した時は、build-vocab で作った memmap の軽い語彙を使う (doc2bow と len が同じように使える)
+    if vocab_path is not None:
+        from vocab import ServingVocab
+        return ServingVocab.load(vocab_path)
+    if words_list is None:
+        from gensim import corpora
+        return corpora.Dictionary.load_from_text(os.path.join(PROJECT_DIR, 'dic', DIC_NAME))
+    return load_dic(PROJECT_DIR, words_list)
+
+def make_data_set(words_list, labels, dic, split):
+    import numpy as np
+    from gensim import matutils
+    from keras.preprocessing import sequence
+    from keras.utils import np_utils
+
     # 辞書の次元→ len(dic.keys()) or len(dic.values())
     vecs = [dic.doc2bow(word_list) for word_list in words_list]
     x = [matutils.corpus2dense([vec], num_terms=len(dic)).T[0] for vec in vecs]
-    y = items['label']
-    x_train, x_test, y_train, y_test = train_test_split(x, y, train_size=0.8)
-    x_train = np.array(x_train)
-    x_test = np.array(x_test)
-    y_test = np.array(y_test)
-    y_train = np.array(y_train)
+    # 分け方は split (SplitManifest) に保存したものを毎回使う
+    x_train = np.array([x[i] for i in split.train])
+    x_test = np.array([x[i] for i in split.test])
+    y_train = np.array([labels[i] for i in split.train])
+    y_test = np.array([labels[i] for i in split.test])
     x_train = sequence.pad_sequences(x_train, maxlen=len(x_train[0]))
     x_test = sequence.pad_sequences(x_test, maxlen=len(x_train[0]))
-    y_train = np_utils.to_categorical(y_train)
-    y_test = np_utils.to_categorical(y_test)
-    return x_train, x_test, y_train, y_test, x
+    y_train = np_utils.to_categorical(y_train, max(labels) + 1)
+    y_test = np_utils.to_categorical(y_test, max(labels) + 1)
+    return x_train, x_test, y_train, y_test, split.test
+
+def load_split(words):
+    # 無ければ作る。words.json を作り直した後は `split --force` で作り直す
+    from splits import SplitManifest
+    if not os.path.exists(SPLIT_PATH + '.json'):
+        split = SplitManifest.create(words['label'], WORDS_PATH)
+        split.save(SPLIT_PATH)
+        print('saved split to {0}'.format(SPLIT_PATH))
+    split = SplitManifest.load(SPLIT_PATH)
+    split.check(WORDS_PATH)
+    return split
+
+def set_seed(seed):
+    # 重みの初期値やシャッフルも毎回同じにする
+    import random
+    import numpy as np
+    random.seed(seed)
+    np.random.seed(seed)
+    try:
+        import tensorflow as tf
+    except ImportError:
+        return
+    if hasattr(tf, 'set_random_seed'):
+        tf.set_random_seed(seed)
+    else:
+        tf.random.set_seed(seed)
+
+def dic_path_for(vocab_path):
+    return vocab_path if vocab_path is not None else os.path.join(PROJECT_DIR, 'dic', DIC_NAME)
 
 def make_model(input_dim, output_dim):
+    from keras.models import Sequential
+    from keras.layers import Dense
+
     # set parameters:
     first_hidden=400
     second_hidden=200
@@ -94,7 +124,9 @@ def make_model(input_dim, output_dim):
     return model
 
 def load_model(input_dim, output_dim):
-    model_path = os.path.join(project_dir, 'model/model_json1.json')
+    from keras.models import model_from_json
+
+    model_path = MODEL_PATH
     if not os.path.exists(model_path):
         print('made {0}'.format(model_path))
         model = make_model(input_dim, output_dim)
@@ -111,48 +143,245 @@ def load_model(input_dim, output_dim):
                 print('made {0}/{1}.'.format(model_path.split('/')[-2], model_path.split('/')[-1]))
     return model, model_path
 
+def load_words(words_path=WORDS_PATH):
+    with open(words_path) as f:
+        return json.load(f)
 
+def load_label_names(label_names_path=LABEL_NAMES_PATH):
+    with open(label_names_path) as f:
+        label_names = json.load(f)
+    return [label_names[str(i)] for i in range(len(label_names))]
 
-if __name__ == '__main__':
-    project_dir = os.path.dirname(__file__)
-    DATA_DIR = os.path.join(project_dir, 'data/processed')
+def load_trained_model(model_path=MODEL_PATH):
+    # ModelCheckpoint が保存した学習済みのモデル
+    import keras
+    return keras.models.load_model(model_path)
+
+def prepare(args):
+    # livedoor.json を分かち書きして words.json に保存する (一番時間がかかるので一度だけ)
     items = load_json(DATA_DIR)
-    words_list = make_words_list(items['data'])
-    dic = load_dic(project_dir, words_list) # ストップワードの除去で精度上がるかも。
-    
-    x_train, x_test, y_train, y_test, x = make_data_set(words_list, dic)
+    data, labels = items['data'], items['label']
+    keep = list(range(len(data)))
+    if args.dedup_threshold > 0:
+        # 同じ記事や定型文だけの記事は、辞書や学習に使う前に除く
+        from dedup import DuplicateFilter
+        keep = DuplicateFilter(threshold=args.dedup_threshold).keep_indices(clean_text(text) for text in data)
+        print('dedup: {0} -> {1} documents'.format(len(data), len(keep)))
+        data, labels = [data[i] for i in keep], [labels[i] for i in keep]
+    words_list = make_words_list(data)
+    with open(WORDS_PATH, 'w') as f:
+        # data_indices は livedoor.json の中での位置
+        json.dump({'words': words_list, 'label': labels, 'data_indices': keep}, f, ensure_ascii=False)
+    with open(LABEL_NAMES_PATH, 'w') as f:
+        json.dump(items['label_names'], f, ensure_ascii=False)
+    print('saved {0} documents to {1}'.format(len(words_list), WORDS_PATH))
+
+def build_dic(args):
+    dic_path = os.path.join(PROJECT_DIR, 'dic', DIC_NAME)
+    if os.path.exists(dic_path):
+        os.remove(dic_path)
+    dic = load_dic(PROJECT_DIR, load_words()['words']) # ストップワードの除去で精度上がるかも。
+    print('saved {0} words to {1}'.format(len(dic), dic_path))
+
+def build_vocab(args):
+    from vocab import ServingVocab
+    vocab = ServingVocab.build(os.path.join(PROJECT_DIR, 'dic', DIC_NAME), args.top_n, args.min_df)
+    vocab.save(args.output)
+    print('saved {0} words to {1}'.format(len(vocab), args.output))
+    if args.top_n is not None or args.min_df is not None:
+        print('ids are renumbered; train with --vocab {0}'.format(args.output))
+
+def train(args):
+    import keras
+
+    words = load_words()
+    dic = load_vocab(words['words'], args.vocab)
+    split = load_split(words)
+    set_seed(split.meta['seed'])
+    x_train, x_test, y_train, y_test, _ = make_data_set(words['words'], words['label'], dic, split)
     model, model_path = load_model(input_dim=len(x_train[0]), output_dim=len(y_train[0]))
     model.summary()
     earlystopping = keras.callbacks.EarlyStopping(monitor='acc', verbose=1, patience=5, mode='auto')
     model_checkpoint = keras.callbacks.ModelCheckpoint(model_path, monitor='acc', save_best_only=True, mode='auto', period=1)
     model.compile(loss="categorical_crossentropy", optimizer="rmsprop", metrics=["accuracy"])
-    model.fit(x_train, y_train, epochs=200, batch_size=128, callbacks=[earlystopping, model_checkpoint], verbose=0)
     print("Now learning from data...")
-    
+    model.fit(x_train, y_train, epochs=args.epochs, batch_size=128, callbacks=[earlystopping, model_checkpoint], verbose=0)
+
+    scores = model.evaluate(x_test, y_test)
+    print("%s: %.2f%%" % (model.metrics_names[1], scores[1] * 100))
+    record_training_run('train', split, args.vocab, scores[1])
+
+def record_training_run(command, split, vocab_path, accuracy):
+    from splits import record_run, run_fingerprint
+    fingerprint = run_fingerprint(split, dic_path_for(vocab_path))
+    record_run(RUNS_PATH, command, fingerprint, accuracy=float(accuracy))
+    print('run fingerprint: {0}'.format(fingerprint['run']))
+
+def make_split(args):
+    from splits import SplitManifest
+    if os.path.exists(SPLIT_PATH + '.json') and not args.force:
+        print('{0} already exists (use --force to remake it)'.format(SPLIT_PATH))
+        return
+    split = SplitManifest.create(load_words()['label'], WORDS_PATH, args.test_size, args.seed)
+    split.save(SPLIT_PATH)
+    print('saved split to {0} (train {1}, test {2})'.format(SPLIT_PATH, len(split.train), len(split.test)))
+
+def evaluate(args):
+    import numpy as np
+
+    words = load_words()
+    label_names = load_label_names()
+    dic = load_vocab(words['words'], args.vocab)
+    split = load_split(words)
+    _, x_test, _, y_test, test_indices = make_data_set(words['words'], words['label'], dic, split)
+    model = load_trained_model(args.model)
+
     scores = model.evaluate(x_test, y_test)
     print("%s: %.2f%%" % (model.metrics_names[1], scores[1] * 100))
-    classes = model.predict_classes(x_test, batch_size=128)
-    proba = model.predict_proba(x_test, batch_size=128)
-    
+    record_training_run('eval', split, args.vocab, scores[1])
+    proba = model.predict(x_test, batch_size=128)
+    classes = np.argmax(proba, axis=1)
+
     # 各ラベルの項目数をカウント
     count_list = collections.Counter(classes)
     for k in sorted(count_list.keys()):
-        print("category {0} ({1}) has {2} items".format(k, items['label_names'][str(k)], count_list[k]))
-    
+        print("category {0} ({1}) has {2} items".format(k, label_names[k], count_list[k]))
+
     # 各ラベルにとって典型的なデータをそれぞれ表示
-    counter1 = range(len(y_test[0]))
-    counter2 = range(len(x[0]))
-    typical_list = [(np.argmax(proba[:,j])) for j in range(len(y_test[0]))]
-    print(typical_list)
-    for index, count1 in zip(typical_list, counter1):
-        print("Most typical content in category {0} ({1}) is this below".format(count1, items['label_names'][str(count1)]))
-        for each_x, count2 in zip(x, counter2):
-            if np.allclose(x_test[index], each_x):
-                print(items['data'][count2])
-                break
-    
+    if args.show_typical:
+        items = load_json(DATA_DIR)
+        typical_list = [(np.argmax(proba[:,j])) for j in range(len(y_test[0]))]
+        print(typical_list)
+        for count1, index in enumerate(typical_list):
+            print("Most typical content in category {0} ({1}) is this below".format(count1, label_names[count1]))
+            print(items['data'][words['data_indices'][test_indices[index]]])
+
     # 間違ったラベルへの分類をしたデータを確認
     for i in range(len(y_test)):
         itemindex = np.where(y_test[i] == 1)
         if classes[i] != itemindex[0]:
-            print("count {0}  ==>  wrong predict : {1} , answer is {2}".format(i, classes[i], itemindex[0][0]))
\ No newline at end of file
+            print("count {0}  ==>  wrong predict : {1} , answer is {2}".format(i, classes[i], itemindex[0][0]))
+
+def predict(args):
+    import numpy as np
+
+    if len(args.files) == 0:
+        texts = [sys.stdin.read()]
+    else:
+        texts = []
+        for path in args.files:
+            with open(path) as f:
+                texts.append(f.read())
+    # livedoor の記事は先頭の2行 (URLと日付) を除く。ツイートはそのまま
+    clean = clean_tweet if args.tweet else clean_text
+    words_list = [tokenize(clean(text)) for text in texts]
+    dic = load_vocab(vocab_path=args.vocab)
+    label_names = load_label_names()
+    if args.engine is not None:
+        # export で書き出したモデルを NumPy だけで推論する (Keras を import しない)
+        from quantize import NumpyClassifier
+        engine = NumpyClassifier(args.engine)
+        engine.check_vocab(dic)
+        proba = engine.predict_proba_bow([dic.doc2bow(words) for words in words_list])
+    else:
+        from gensim import matutils
+        x = np.array([matutils.corpus2dense([dic.doc2bow(words)], num_terms=len(dic)).T[0] for words in words_list])
+        proba = load_trained_model(args.model).predict(x, batch_size=128)
+    for name, p in zip(args.files or ['-'], proba):
+        print('{0}\t{1}\t{2:.4f}'.format(name, label_names[int(np.argmax(p))], float(np.max(p))))
+
+def export(args):
+    from quantize import NumpyClassifier, compare, export_model
+    from splits import record_run, run_fingerprint
+
+    output = args.output or ENGINE_PATH.format(args.first_layer)
+    words = load_words()
+    dic = load_vocab(words['words'], args.vocab)
+    model = load_trained_model(args.model)
+    export_model(model, output, args.first_layer, dic)
+    print('exported {0} to {1}'.format(args.model, output))
+
+    # テストデータで Keras のモデルと精度を比べる
+    engine = NumpyClassifier(output)
+    engine.check_vocab(dic)
+    split = load_split(words)
+    _, x_test, _, y_test, _ = make_data_set(words['words'], words['label'], dic, split)
+    result = compare(model, engine, x_test, y_test)
+    for key in sorted(result):
+        print('{0}: {1:.4f}'.format(key, result[key]))
+    record_run(RUNS_PATH, 'export', run_fingerprint(split, dic_path_for(args.vocab)), **result)
+
+def import_time_ms(module='classify'):
+    # python -X importtime の出力から module の累積の import 時間 (ミリ秒) を取り出す
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                         cwd=PROJECT_DIR, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    for line in res.stderr.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000.0
+    raise ValueError('{0} not found in -X importtime output'.format(module))
+
+def check_import_time(args):
+    elapsed = import_time_ms()
+    print('import classify: {0:.1f} ms (budget {1} ms)'.format(elapsed, args.budget))
+    if elapsed > args.budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='livedoorコーパスの文書分類')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    subparser = subparsers.add_parser('prepare', help='livedoor.jsonを分かち書きしてwords.jsonに保存する')
+    subparser.add_argument('--dedup-threshold', type=float, default=0.9,
+                           help='この値以上似ている記事を重複として除く (0で除かない)')
+    subparser.set_defaults(func=prepare)
+
+    subparser = subparsers.add_parser('build-dic', help='words.jsonから辞書を作り直す')
+    subparser.set_defaults(func=build_dic)
+
+    subparser = subparsers.add_parser('split', help='学習・評価で使い回すデータの分け方を作る')
+    subparser.add_argument('--seed', type=int, default=0)
+    subparser.add_argument('--test-size', type=float, default=0.2)
+    subparser.add_argument('--force', action='store_true', help='既にあっても作り直す')
+    subparser.set_defaults(func=make_split)
+
+    subparser = subparsers.add_parser('build-vocab', help='辞書から推論用の軽い語彙を作る')
+    subparser.add_argument('--top-n', type=int, default=None, help='文書頻度の高い順にこの数だけ残す')
+    subparser.add_argument('--min-df', type=int, default=None, help='文書頻度がこの値未満の単語を除く')
+    subparser.add_argument('--output', default=VOCAB_PATH)
+    subparser.set_defaults(func=build_vocab)
+
+    subparser = subparsers.add_parser('train', help='モデルを学習する')
+    subparser.add_argument('--epochs', type=int, default=200)
+    subparser.add_argument('--vocab', default=None, help='build-vocab で作った語彙 (省略時は辞書)')
+    subparser.set_defaults(func=train)
+
+    subparser = subparsers.add_parser('eval', help='テストデータで学習済みのモデルを評価する')
+    subparser.add_argument('--model', default=MODEL_PATH)
+    subparser.add_argument('--show-typical', action='store_true', help='各ジャンルの典型的な記事を表示する')
+    subparser.add_argument('--vocab', default=None, help='build-vocab で作った語彙 (省略時は辞書)')
+    subparser.set_defaults(func=evaluate)
+
+    subparser = subparsers.add_parser('predict', help='文書のジャンルを予測する (ファイルを省略すると標準入力)')
+    subparser.add_argument('files', nargs='*')
+    subparser.add_argument('--model', default=MODEL_PATH)
+    subparser.add_argument('--vocab', default=None, help='build-vocab で作った語彙 (省略時は辞書)')
+    subparser.add_argument('--engine', default=None, help='export で書き出したモデル (Kerasを使わずに推論する)')
+    subparser.add_argument('--tweet', action='store_true', help='記事ではなくツイートとして扱う (先頭の2行を除かない)')
+    subparser.set_defaults(func=predict)
+
+    subparser = subparsers.add_parser('export', help='学習済みのモデルを量子化してNumPyだけで推論できる形で書き出す')
+    subparser.add_argument('--model', default=MODEL_PATH)
+    subparser.add_argument('--output', default=None, help='省略時は model/classifier_<first-layer>.npz')
+    subparser.add_argument('--first-layer', choices=['int8', 'float16'], default='int8')
+    subparser.add_argument('--vocab', default=None, help='モデルの学習に使った語彙 (省略時は辞書)')
+    subparser.set_defaults(func=export)
+
+    subparser = subparsers.add_parser('check-import-time', help='import classify の時間が予算内か確かめる')
+    subparser.add_argument('--budget', type=float, default=IMPORT_TIME_BUDGET_MS, help='ミリ秒')
+    subparser.set_defaults(func=check_import_time)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,140 @@
+import argparse
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from classify import LABEL_NAMES_PATH, MODEL_PATH, load_label_names, load_trained_model, load_vocab
+from preprocess import tokenize
+from recommend import TWEETS_DIR, is_store_uri, iter_user_tweets, list_users, open_store
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_PATH = os.path.join(PROJECT_DIR, 'data', 'processed', 'tweet_genres.json')
+STATS_NAME = 'genre'
+
+
+def iter_tweets(source, users):
+    # (user, tweet) を一件ずつ返す
+    store = open_store(source) if is_store_uri(source) else None
+    try:
+        for user in users:
+            for tweet in iter_user_tweets(source, user, store):
+                yield user, tweet
+    finally:
+        if store is not None:
+            store.close()
+
+def _tokenize(item):
+    user, tweet = item
+    return user, tokenize(tweet)
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+def vectorize(words_list, dic):
+    # classify.make_data_set と同じ one-hot (出現回数) 表現。バッチ分だけ密行列にする
+    x = np.zeros((len(words_list), len(dic)), dtype=np.float32)
+    for row, words in enumerate(words_list):
+        for word_id, count in dic.doc2bow(words):
+            x[row, word_id] = count
+    return x
+
+def predict_batch(model, dic, batch, batch_size, sums, counts, n_labels):
+    batch = [(user, words) for user, words in batch if len(words) > 0]
+    if len(batch) == 0:
+        return
+    if hasattr(model, 'predict_proba_bow'):
+        # NumpyClassifier は密行列を作らずに doc2bow のまま推論できる
+        proba = model.predict_proba_bow([dic.doc2bow(words) for _, words in batch])
+    else:
+        proba = model.predict(vectorize([words for _, words in batch], dic), batch_size=batch_size)
+    for (user, _), p in zip(batch, proba):
+        if user not in sums:
+            sums[user] = np.zeros(n_labels)
+            counts[user] = np.zeros(n_labels, dtype=np.int64)
+        sums[user] += p
+        counts[user][np.argmax(p)] += 1
+
+def classify_tweets(source=TWEETS_DIR, classifier_path=MODEL_PATH, labels_path=LABEL_NAMES_PATH,
+                    batch_size=1024, workers=None, vocab_path=None, engine_path=None):
+    # ユーザーごとに、ジャンルの確率の平均と、最も確率の高いジャンルの件数を返す
+    # TensorFlow は fork に対応していないので、Keras のモデルを読む前にワーカー (分かち書きだけを行う) を作る
+    pool = multiprocessing.Pool(workers or multiprocessing.cpu_count())
+    try:
+        dic = load_vocab(vocab_path=vocab_path)
+        if engine_path is not None:
+            from quantize import NumpyClassifier
+            model = NumpyClassifier(engine_path)
+            model.check_vocab(dic)
+        else:
+            model = load_trained_model(classifier_path)
+        label_names = load_label_names(labels_path)
+
+        sums = {}
+        counts = {}
+        # 分かち書きはプロセスを分けて並列に、推論はバッチでまとめて行う
+        # Pool.imap は入力を先読みしきってしまうので、バッチごとに渡してメモリを抑える
+        # 次のバッチの分かち書きは、今のバッチの推論と重ねて進める
+        batches = iter_batches(iter_tweets(source, list_users(source)), batch_size)
+        pending = None
+        for batch in batches:
+            next_pending = pool.map_async(_tokenize, batch, chunksize=64)
+            if pending is not None:
+                predict_batch(model, dic, pending.get(), batch_size, sums, counts, len(label_names))
+            pending = next_pending
+        if pending is not None:
+            predict_batch(model, dic, pending.get(), batch_size, sums, counts, len(label_names))
+    finally:
+        pool.close()
+        pool.join()
+
+    results = {}
+    for user in sums:
+        total = int(counts[user].sum())
+        results[user] = {
+            'tweets': total,
+            'distribution': dict(zip(label_names, (sums[user] / total).tolist())),
+            'counts': dict(zip(label_names, counts[user].tolist())),
+        }
+    return results
+
+def save_results(results, source, output_path=OUTPUT_PATH):
+    # ストアから読んだ時はストアに、ファイルから読んだ時は json に書き戻す
+    if is_store_uri(source):
+        store = open_store(source)
+        try:
+            for user, stats in results.items():
+                store.saveUserStats(user, STATS_NAME, stats)
+        finally:
+            store.close()
+    else:
+        with open(output_path, 'w') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ツイートをlivedoorのジャンルに分類し、ユーザーごとの分布を保存する')
+    parser.add_argument('--source', default=TWEETS_DIR, help='data/tweets のようなディレクトリか、ツイートストアの uri')
+    parser.add_argument('--classifier', default=MODEL_PATH)
+    parser.add_argument('--labels', default=LABEL_NAMES_PATH, help='classify.py prepare が保存した label_names.json')
+    parser.add_argument('--output', default=OUTPUT_PATH, help='ディレクトリから読んだ時の保存先')
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--vocab', default=None, help='classify.py build-vocab で作った語彙 (省略時は辞書)')
+    parser.add_argument('--engine', default=None, help='classify.py export で書き出したモデル (Kerasを使わずに推論する)')
+    args = parser.parse_args()
+
+    results = classify_tweets(args.source, args.classifier, args.labels, args.batch_size, args.workers, args.vocab,
+                              args.engine)
+    save_results(results, args.source, args.output)
+    for user in sorted(results):
+        distribution = results[user]['distribution']
+        print('{0}\t{1}'.format(user, max(distribution, key=distribution.get)))
@@ -0,0 +1,99 @@
+import collections
+import hashlib
+import zlib
+
+import numpy as np
+
+# MinHash のハッシュ関数 (a * x + b) mod PRIME で使う素数 (2^31 - 1)
+PRIME = (1 << 31) - 1
+
+
+def exact_hash(doc):
+    if not isinstance(doc, str):
+        doc = '\x00'.join(doc)
+    return hashlib.sha1(doc.encode('utf-8')).digest()
+
+def shingles(doc, k):
+    # doc が文字列なら文字の、単語のリストなら単語の k-gram をハッシュした集合
+    if isinstance(doc, str):
+        grams = (doc[i:i + k] for i in range(max(len(doc) - k + 1, 1)))
+    else:
+        grams = ('\x00'.join(doc[i:i + k]) for i in range(max(len(doc) - k + 1, 1)))
+    return set(zlib.crc32(gram.encode('utf-8')) % PRIME for gram in grams)
+
+def choose_bands(num_perm, threshold):
+    # (1/b)^(1/r) が threshold に一番近い (バンド数, 1バンドの行数)
+    candidates = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(candidates, key=lambda br: abs((1.0 / br[0]) ** (1.0 / br[1]) - threshold))
+
+
+class DuplicateFilter(object):
+    '''
+    完全一致 (ハッシュ) と、MinHash + LSH による近似重複 (Jaccard 係数が threshold 以上) を取り除く
+    最近の capacity 件だけを覚えておくので、メモリは一定以上増えない
+    '''
+
+    def __init__(self, threshold=0.9, num_perm=64, k=5, capacity=100000, seed=0):
+        self.threshold = threshold
+        self.k = k
+        self.capacity = capacity
+        self.bands, self.rows = choose_bands(num_perm, threshold)
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, PRIME, size=num_perm).astype(np.int64)
+        self.b = rng.randint(0, PRIME, size=num_perm).astype(np.int64)
+        self.exact = collections.OrderedDict()
+        # key → MinHash のシグネチャ (古い順)
+        self.signatures = collections.OrderedDict()
+        self.buckets = [{} for _ in range(self.bands)]
+        self.count = 0
+
+    def signature(self, doc):
+        x = np.fromiter(shingles(doc, self.k), dtype=np.int64)
+        return ((np.outer(x, self.a) + self.b) % PRIME).min(axis=0)
+
+    def band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def is_duplicate(self, doc):
+        # 重複なら True。重複でなければ覚えて False
+        digest = exact_hash(doc)
+        if digest in self.exact:
+            return True
+        signature = self.signature(doc)
+        band_keys = self.band_keys(signature)
+        candidates = set()
+        for bucket, band_key in zip(self.buckets, band_keys):
+            candidates.update(bucket.get(band_key, ()))
+        for key in candidates:
+            if np.mean(self.signatures[key] == signature) >= self.threshold:
+                return True
+        self.remember(digest, signature, band_keys)
+        return False
+
+    def remember(self, digest, signature, band_keys):
+        key = self.count
+        self.count += 1
+        self.exact[digest] = key
+        self.signatures[key] = signature
+        for bucket, band_key in zip(self.buckets, band_keys):
+            bucket.setdefault(band_key, set()).add(key)
+        while len(self.signatures) > self.capacity:
+            self.forget()
+
+    def forget(self):
+        self.exact.popitem(last=False)
+        key, signature = self.signatures.popitem(last=False)
+        for bucket, band_key in zip(self.buckets, self.band_keys(signature)):
+            keys = bucket.get(band_key)
+            if keys is not None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del bucket[band_key]
+
+    def filter(self, docs):
+        for doc in docs:
+            if not self.is_duplicate(doc):
+                yield doc
+
+    def keep_indices(self, docs):
+        return [i for i, doc in enumerate(docs) if not self.is_duplicate(doc)]
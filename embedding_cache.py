@@ -0,0 +1,81 @@
+import collections
+import glob
+import hashlib
+import os
+import shutil
+
+import numpy as np
+
+from splits import file_hash
+
+
+def model_fingerprint(model_path):
+    # モデル本体と、gensim が横に保存する .npy をまとめたハッシュ (再学習すると変わる)
+    hashes = [file_hash(path) for path in [model_path] + sorted(glob.glob(model_path + '.*.npy'))]
+    return hashlib.sha1(''.join(hashes).encode('ascii')).hexdigest()[:16]
+
+def content_hash(texts):
+    sha1 = hashlib.sha1()
+    for text in texts:
+        sha1.update(text.encode('utf-8'))
+        sha1.update(b'\n')
+    return sha1.hexdigest()
+
+
+class EmbeddingCache(object):
+    '''
+    infer_vector の結果を、モデルのフィンガープリントと文書のハッシュをキーにして保存する
+    メモリ (LRU) とディスクの二段構え。ディスクはモデルのバージョン (フィンガープリント) ごとのディレクトリに分ける
+    メモリの段はプロセスの中でだけ使えるので、呼び出しごとに終わるワーカープロセスではディスクの段だけが残る
+    '''
+
+    def __init__(self, model_path, cache_dir=None, maxsize=10000, fingerprint=None):
+        # fingerprint を渡すと、モデルのファイルを読んでハッシュを計算し直さない
+        self.fingerprint = fingerprint or model_fingerprint(model_path)
+        self.maxsize = maxsize
+        self.memory = collections.OrderedDict()
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            self.model_dir = os.path.join(cache_dir, self.fingerprint)
+            if not os.path.exists(self.model_dir):
+                os.makedirs(self.model_dir)
+
+    def disk_path(self, key):
+        return os.path.join(self.model_dir, key[:2], key + '.npy')
+
+    def get(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+        if self.cache_dir is None or not os.path.exists(self.disk_path(key)):
+            return None
+        vector = np.load(self.disk_path(key))
+        self.remember(key, vector)
+        return vector
+
+    def put(self, key, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        self.remember(key, vector)
+        if self.cache_dir is not None:
+            path = self.disk_path(key)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 他のプロセスが書き込み途中のファイルを読まないように置き換える
+            tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                np.save(f, vector)
+            os.replace(tmp_path, path)
+
+    def remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def invalidate_stale(self):
+        # 今のモデル以外 (再学習する前のモデル) のキャッシュを消す
+        if self.cache_dir is None:
+            return
+        for name in os.listdir(self.cache_dir):
+            if name != self.fingerprint:
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
@@ -0,0 +1,91 @@
+import argparse
+import json
+import multiprocessing
+import os
+
+from preprocess import clean_tweet
+from recommend import TWEETS_DIR, open_store
+
+STATE_NAME = '.export_state.json'
+
+# ワーカープロセスごとに開いたストア
+_worker = {}
+
+
+def load_state(output_dir):
+    # ユーザーごとに、前回書き出した時の最大の id
+    path = os.path.join(output_dir, STATE_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(output_dir, state):
+    path = os.path.join(output_dir, STATE_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+def _init_worker(source, output_dir, batch_size):
+    _worker['store'] = open_store(source)
+    _worker['output_dir'] = output_dir
+    _worker['batch_size'] = batch_size
+
+def _export_user(user):
+    # text だけを batch_size 件ずつ読み、一時ファイルに書いてから置き換える
+    path = os.path.join(_worker['output_dir'], user + '.txt')
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    count = 0
+    try:
+        # テキストモードなので改行は '\n' で書く (os.linesep だと Windows で \r\r\n になる)
+        with open(tmp_path, 'w', buffering=1 << 20) as f:
+            for tweet in _worker['store'].iterUser(user, fields=['text'], batchSize=_worker['batch_size']):
+                f.write(clean_tweet(tweet['text']) + '\n')
+                count += 1
+        os.replace(tmp_path, path)
+    finally:
+        # 失敗した時に一時ファイルを残さない (成功した時は置き換え済みで無い)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return user, count
+
+def export_tweets(source, output_dir=TWEETS_DIR, workers=None, batch_size=1000, force=False):
+    # 前回から新しいツイートが増えたユーザーだけを書き出し、{user: 件数} を返す
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    store = open_store(source)
+    try:
+        latest = dict((user, store.maxId(user)) for user in store.users())
+    finally:
+        store.close()
+    state = {} if force else load_state(output_dir)
+    todo = [user for user in sorted(latest)
+            if state.get(user) != latest[user] or not os.path.exists(os.path.join(output_dir, user + '.txt'))]
+
+    exported = {}
+    if len(todo) > 0:
+        pool = multiprocessing.Pool(min(workers or multiprocessing.cpu_count(), len(todo)),
+                                    initializer=_init_worker, initargs=(source, output_dir, batch_size))
+        try:
+            for user, count in pool.imap_unordered(_export_user, todo):
+                exported[user] = count
+                state[user] = latest[user]
+                print('{0}: {1}件'.format(user, count))
+        finally:
+            pool.close()
+            pool.join()
+            save_state(output_dir, state)
+    return exported
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ツイートストアのユーザーごとのツイートを data/tweets/<user>.txt に書き出す')
+    parser.add_argument('source', help='ツイートストアの uri (例: mongodb://localhost:27017/#起業, sqlite:///data/tweets.sqlite3)')
+    parser.add_argument('--output', default=TWEETS_DIR)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=1000, help='カーソルで一度に読む件数')
+    parser.add_argument('--force', action='store_true', help='新しいツイートが無いユーザーも書き出し直す')
+    args = parser.parse_args()
+
+    exported = export_tweets(args.source, args.output, args.workers, args.batch_size, args.force)
+    print('exported {0} users'.format(len(exported)))
@@ -1,5 +1,6 @@
+import argparse
 import os
-import urllib
+import urllib.request
 import tarfile
 from collections import defaultdict
 import json
@@ -13,7 +14,7 @@ def save_file(url, save_path):
         print('{} already exists.'.format(file_path))
     else:
         print('Downloading {}'.format(file_name))
-        file_path, _ = urllib.urlretrieve(url, file_path)
+        file_path, _ = urllib.request.urlretrieve(url, file_path)
     return file_path
     
 def extract_file(file_path, save_path):
@@ -25,11 +26,11 @@ def make_corpus(data_dir):
     vocabulary = defaultdict()
     vocabulary.default_factory = vocabulary.__len__
     
-    for file_or_dir in os.listdir(data_dir):
+    for file_or_dir in sorted(os.listdir(data_dir)):
         if file_or_dir.endswith('.txt'):
             continue
         label = file_or_dir
-        for file in os.listdir(os.path.join(data_dir, label)):
+        for file in sorted(os.listdir(os.path.join(data_dir, label))):
             if file == 'LICENSE.txt':
                 continue
             with open(os.path.join(os.path.join(data_dir, label, file))) as f:
@@ -43,21 +44,39 @@ def save_corpus(processed_dir, corpus):
     with open(os.path.join(processed_dir, 'livedoor.json'), 'w') as f:
         json.dump(corpus, f)
 
-def main(project_dir, save_path):
-    url = 'http://www.rondhuit.com/download/ldcc-20140209.tar.gz'
-    file_path = save_file(url=url, save_path=save_path)
+URL = 'http://www.rondhuit.com/download/ldcc-20140209.tar.gz'
+
+def download(project_dir, save_path):
+    file_path = save_file(url=URL, save_path=save_path)
     
-    data_dir = os.path.join(raw_dir, 'text')
+    data_dir = os.path.join(save_path, 'text')
     if not os.path.exists(data_dir):
         extract_file(file_path, save_path)
-    
+    return data_dir
+
+def build_corpus(project_dir, save_path, overwrite=False):
+    data_dir = os.path.join(save_path, 'text')
     corpus = make_corpus(data_dir)
     processed_dir = os.path.join(project_dir, 'data/processed')
-    if not os.path.exists(os.path.join(processed_dir, 'livedoor.json')):
+    if overwrite or not os.path.exists(os.path.join(processed_dir, 'livedoor.json')):
         save_corpus(processed_dir, corpus)
+
+def main(project_dir, save_path):
+    download(project_dir, save_path)
+    build_corpus(project_dir, save_path)
     
 if __name__ == '__main__':
-    project_dir = os.path.join(os.path.dirname(__file__))
+    project_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
     raw_dir = os.path.join(project_dir, 'data/raw')
     
-    main(project_dir, raw_dir)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='livedoorコーパスのダウンロードとjsonへの変換')
+    parser.add_argument('step', nargs='?', choices=['download', 'corpus'], help='省略すると両方')
+    args = parser.parse_args()
+    
+    if args.step == 'download':
+        download(project_dir, raw_dir)
+    elif args.step == 'corpus':
+        # 段階を指定した時は、元のデータが変わっていることがあるので作り直す
+        build_corpus(project_dir, raw_dir, overwrite=True)
+    else:
+        main(project_dir, raw_dir)
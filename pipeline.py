@@ -0,0 +1,306 @@
+import argparse
+import ast
+import concurrent.futures
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+from splits import file_hash
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_PATH = os.path.join(PROJECT_DIR, 'data', 'pipeline_state.json')
+LOG_PATH = os.path.join(PROJECT_DIR, 'data', 'pipeline_log.jsonl')
+
+
+def function_source(path, name):
+    # path のトップレベルの name と、そこから名前で参照しているトップレベルの関数・クラス・定数のソース
+    # (classify.py のように一つのファイルに段がまとまっている時、他のサブコマンドを直しても段を作り直さない)
+    with open(path) as f:
+        source = f.read()
+    defs = {}
+    for node in ast.parse(source).body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            defs[node.name] = node
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    defs[target.id] = node
+    if name not in defs:
+        raise ValueError('{0} is not defined in {1}'.format(name, path))
+    found = set()
+    stack = [name]
+    while stack:
+        node = defs.get(stack.pop())
+        if node is None or node in found:
+            continue
+        found.add(node)
+        stack.extend(child.id for child in ast.walk(node) if isinstance(child, ast.Name))
+    return '\n'.join(ast.get_source_segment(source, node) for node in sorted(found, key=lambda node: node.lineno))
+
+
+class FileHasher(object):
+    '''
+    ファイルとディレクトリの中身のハッシュ
+    更新時刻とサイズが前回と同じファイルは、前回のハッシュを使う
+    '''
+
+    def __init__(self, cache):
+        # 相対パス → [更新時刻, サイズ, sha1]
+        self.cache = cache
+
+    def file(self, path):
+        st = os.stat(path)
+        rel = os.path.relpath(path, PROJECT_DIR)
+        cached = self.cache.get(rel)
+        if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        digest = file_hash(path)
+        self.cache[rel] = [st.st_mtime_ns, st.st_size, digest]
+        return digest
+
+    def path(self, path):
+        # 無ければ None。ディレクトリは中のファイルの名前とハッシュをまとめる (書き込み途中の .tmp は除く)
+        # 'classify.py:train' のように指定すると、その関数と、それが使う関数のソースだけのハッシュ
+        if '.py:' in path:
+            file_path, name = path.rsplit(':', 1)
+            return hashlib.sha1(function_source(file_path, name).encode('utf-8')).hexdigest()
+        if not os.path.exists(path):
+            return None
+        if not os.path.isdir(path):
+            return self.file(path)
+        sha1 = hashlib.sha1()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith('.tmp'):
+                    continue
+                full = os.path.join(root, name)
+                sha1.update(os.path.relpath(full, path).encode('utf-8'))
+                sha1.update(self.file(full).encode('ascii'))
+        return sha1.hexdigest()
+
+
+class Stage(object):
+    '''
+    パイプラインの一段。command を PROJECT_DIR で実行し、inputs から outputs を作る
+    always=True の段 (ツイートの取得など、入力をファイルで表せないもの) は毎回実行する
+    '''
+
+    def __init__(self, name, command, inputs=(), outputs=(), deps=(), always=False, stdout=None):
+        self.name = name
+        self.command = command
+        self.inputs = [os.path.join(PROJECT_DIR, path) for path in inputs]
+        self.outputs = [os.path.join(PROJECT_DIR, path) for path in outputs]
+        self.deps = list(deps)
+        self.always = always
+        # 標準出力をこのファイルに保存する
+        self.stdout = os.path.join(PROJECT_DIR, stdout) if stdout is not None else None
+
+
+class Pipeline(object):
+    '''
+    依存関係のある段を、入力が変わった段だけ、依存しない段は並列に実行する
+    '''
+
+    def __init__(self, stages, state_path=STATE_PATH, log_path=LOG_PATH):
+        self.stages = dict((stage.name, stage) for stage in stages)
+        self.order = [stage.name for stage in stages]
+        self.state_path = state_path
+        self.log_path = log_path
+        self.state = {'stages': {}, 'files': {}}
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+        self.hasher = FileHasher(self.state['files'])
+
+    def select(self, targets):
+        # targets と、それが依存する段すべて
+        selected = set()
+        stack = list(targets or self.order)
+        while stack:
+            name = stack.pop()
+            if name not in self.stages:
+                raise ValueError('unknown stage: {0}'.format(name))
+            if name not in selected:
+                selected.add(name)
+                stack.extend(dep for dep in self.stages[name].deps if dep in self.stages)
+        return selected
+
+    def stage_key(self, stage):
+        inputs = dict((os.path.relpath(path, PROJECT_DIR), self.hasher.path(path)) for path in stage.inputs)
+        payload = json.dumps({'command': stage.command[1:], 'inputs': inputs}, sort_keys=True)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def output_hashes(self, stage):
+        return dict((os.path.relpath(path, PROJECT_DIR), self.hasher.path(path)) for path in stage.outputs)
+
+    def is_fresh(self, stage, key):
+        if stage.always:
+            return False
+        outputs = self.output_hashes(stage)
+        if any(digest is None for digest in outputs.values()):
+            return False
+        if len(stage.inputs) == 0:
+            # 入力の無い段 (ダウンロードなど) は、出力があれば良い
+            return True
+        record = self.state['stages'].get(stage.name)
+        return record is not None and record['key'] == key and record['outputs'] == outputs
+
+    def execute(self, stage):
+        start = time.time()
+        if stage.stdout is not None:
+            with open(stage.stdout + '.tmp', 'w') as f:
+                subprocess.run(stage.command, cwd=PROJECT_DIR, stdout=f, check=True)
+            os.replace(stage.stdout + '.tmp', stage.stdout)
+        else:
+            subprocess.run(stage.command, cwd=PROJECT_DIR, check=True)
+        return time.time() - start
+
+    def log(self, stage, status, seconds=0.0):
+        print('[{0}] {1} ({2:.1f}s)'.format(stage.name, status, seconds))
+        sys.stdout.flush()
+        with open(self.log_path, 'a') as f:
+            f.write(json.dumps({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'stage': stage.name,
+                                'status': status, 'seconds': round(seconds, 3)}) + '\n')
+
+    def save_state(self):
+        with open(self.state_path + '.tmp', 'w') as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def run(self, targets=None, force=False, workers=4):
+        # 成功した段の名前の集合を返す
+        pending = self.select(targets)
+        done = set()
+        failed = set()
+        running = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            while pending or running:
+                for name in [name for name in self.order if name in pending]:
+                    stage = self.stages[name]
+                    deps = [dep for dep in stage.deps if dep in self.stages]
+                    if any(dep in failed for dep in deps):
+                        pending.discard(name)
+                        failed.add(name)
+                        self.log(stage, 'skipped (dependency failed)')
+                        continue
+                    if not all(dep in done for dep in deps):
+                        continue
+                    pending.discard(name)
+                    key = self.stage_key(stage)
+                    if not force and self.is_fresh(stage, key):
+                        done.add(name)
+                        self.log(stage, 'up to date')
+                        continue
+                    print('[{0}] running: {1}'.format(name, ' '.join(stage.command[1:])))
+                    running[executor.submit(self.execute, stage)] = (stage, key)
+                if not running:
+                    continue
+                finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    stage, key = running.pop(future)
+                    try:
+                        seconds = future.result()
+                    except (subprocess.CalledProcessError, OSError) as e:
+                        failed.add(stage.name)
+                        self.log(stage, 'failed: {0}'.format(e))
+                        continue
+                    done.add(stage.name)
+                    self.state['stages'][stage.name] = {'key': key, 'outputs': self.output_hashes(stage),
+                                                        'seconds': seconds}
+                    self.save_state()
+                    self.log(stage, 'done', seconds)
+        self.save_state()
+        return done
+
+
+def make_stages(store=None, target=None, topn=5):
+    from classify import DIC_NAME, ENGINE_PATH, MODEL_PATH, VOCAB_PATH
+
+    python = sys.executable
+    dic = os.path.join('dic', DIC_NAME)
+    words = 'data/processed/words.json'
+    split = 'data/processed/split.npz'
+    vocab = os.path.relpath(VOCAB_PATH, PROJECT_DIR)
+    model = os.path.relpath(MODEL_PATH, PROJECT_DIR)
+    # 各段の入力には、データに加えて実行するコードも含める (コードを直すと、その段から作り直す)
+    # classify.py は段ごとのサブコマンドの関数 (と、それが使う関数) だけを、他のモジュールはファイルごとハッシュする
+    # __main__ の argparse (オプションの既定値など) はハッシュしないので、既定値を変えた時は --force で作り直す
+    corpus_code = ['make_json_data/py.py']
+    recommend_code = ['recommend.py', 'preprocess.py', 'embedding_cache.py', 'splits.py', 'user_index.py']
+    storage_code = ['scraper/storage.py']
+    stages = [
+        # livedoor コーパスの文書分類
+        Stage('download', [python, 'make_json_data/py.py', 'download'], inputs=corpus_code,
+              outputs=['data/raw/text']),
+        Stage('corpus', [python, 'make_json_data/py.py', 'corpus'], inputs=corpus_code + ['data/raw/text'],
+              outputs=['data/processed/livedoor.json'], deps=['download']),
+        Stage('tokenize', [python, 'classify.py', 'prepare'],
+              inputs=['classify.py:prepare', 'preprocess.py', 'dedup.py', 'data/processed/livedoor.json'],
+              outputs=[words, 'data/processed/label_names.json'], deps=['corpus']),
+        Stage('dictionary', [python, 'classify.py', 'build-dic'], inputs=['classify.py:build_dic', words],
+              outputs=[dic], deps=['tokenize']),
+        Stage('split', [python, 'classify.py', 'split', '--force'],
+              inputs=['classify.py:make_split', 'splits.py', words],
+              outputs=[split, 'data/processed/split.json'], deps=['tokenize']),
+        Stage('vectorize', [python, 'classify.py', 'build-vocab'],
+              inputs=['classify.py:build_vocab', 'vocab.py', dic],
+              outputs=[vocab], deps=['dictionary']),
+        # 学習と書き出しは vectorize で作った語彙を使う
+        Stage('train', [python, 'classify.py', 'train', '--vocab', vocab],
+              inputs=['classify.py:train', 'splits.py', 'vocab.py', words, vocab, split],
+              outputs=[model], deps=['vectorize', 'split']),
+        Stage('export', [python, 'classify.py', 'export', '--vocab', vocab],
+              inputs=['classify.py:export', 'splits.py', 'vocab.py', 'quantize.py', model, words, vocab, split],
+              outputs=[os.path.relpath(ENGINE_PATH.format('int8'), PROJECT_DIR)], deps=['train']),
+    ]
+
+    # ツイートの取得と doc2vec によるレコメンド
+    tweet_deps = []
+    if store is not None:
+        # ツイートの取得はファイルで入力を表せないので毎回実行する (取得も書き出しも差分だけ行う)
+        stages.append(Stage('scrape', [python, 'scraper/TwitterScraper.py', '--store', store],
+                            inputs=['scraper/TwitterScraper.py', 'scraper/transport.py'] + storage_code, always=True))
+        stages.append(Stage('export-tweets', [python, 'export_tweets.py', store],
+                            inputs=['export_tweets.py'] + recommend_code + storage_code, outputs=['data/tweets'],
+                            deps=['scrape'], always=True))
+        tweet_deps = ['export-tweets']
+    stages.append(Stage('doc2vec', [python, 'train_doc2vec.py'],
+                        inputs=['train_doc2vec.py', 'dedup.py'] + recommend_code + ['data/tweets'],
+                        outputs=['model/doc2vec.model'], deps=tweet_deps))
+    stages.append(Stage('embed', [python, 'recommend.py'],
+                        inputs=recommend_code + ['model/doc2vec.model', 'data/tweets'],
+                        outputs=['model/user_index.npy', 'model/user_index.json'], deps=['doc2vec']))
+    if target is not None:
+        stages.append(Stage('recommend', [python, 'recommend.py', target, '-n', str(topn)],
+                            inputs=recommend_code + ['model/doc2vec.model', 'data/tweets',
+                                                     'model/user_index.npy', 'model/user_index.json'],
+                            outputs=['data/processed/recommendations.tsv'], deps=['embed'],
+                            stdout='data/processed/recommendations.tsv'))
+    return stages
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='データの取得からレコメンドまでを、変わった段だけ実行する')
+    parser.add_argument('stages', nargs='*', help='実行する段 (依存する段も実行する。省略するとすべて)')
+    parser.add_argument('--force', action='store_true', help='入力が変わっていなくても実行する')
+    parser.add_argument('--workers', type=int, default=4, help='並列に実行する段の数')
+    parser.add_argument('--store', default=None, help='ツイートストアの uri (指定するとツイートの取得と書き出しも行う)')
+    parser.add_argument('--target', default=None, help='レコメンドの対象のユーザー')
+    parser.add_argument('-n', '--topn', type=int, default=5)
+    parser.add_argument('--list', action='store_true', help='段の一覧を表示する')
+    args = parser.parse_args()
+
+    pipeline = Pipeline(make_stages(args.store, args.target, args.topn))
+    if args.list:
+        for name in pipeline.order:
+            stage = pipeline.stages[name]
+            print('{0}\t<- {1}'.format(name, ', '.join(stage.deps) or '-'))
+    else:
+        selected = pipeline.select(args.stages)
+        done = pipeline.run(args.stages, args.force, args.workers)
+        if done != selected:
+            sys.exit(1)
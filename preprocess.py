@@ -0,0 +1,37 @@
+import re
+
+_tagger = None
+
+
+def clean_tweet(text):
+    replaced_text = text.lower()
+    replaced_text = re.sub(r'[【】]', ' ', replaced_text)       # 【】の除去
+    replaced_text = re.sub(r'[（）()]', ' ', replaced_text)     # （）の除去
+    replaced_text = re.sub(r'[［］\[\]]', ' ', replaced_text)   # ［］の除去
+    replaced_text = re.sub(r'[@＠]\w+', '', replaced_text)  # メンションの除去
+    replaced_text = re.sub(r'https?:\/\/.*?[\r\n ]', '', replaced_text)  # URLの除去
+    replaced_text = re.sub(r'　', ' ', replaced_text)  # 全角空白の除去
+    return replaced_text
+
+def get_tagger():
+    # Taggerの生成は重いので、プロセスごとに一度だけ作る
+    global _tagger
+    if _tagger is None:
+        import MeCab
+        _tagger = MeCab.Tagger('mecal-ipadic-neologd')
+    return _tagger
+
+def tokenize(text):
+    mecabTagger = get_tagger()
+    word_list = []
+    res = mecabTagger.parseToNode(text)
+    while res:
+        pos = res.feature.split(",")
+        if pos[0] in ["名詞"]:
+            if not pos[1] in ["代名詞", "固有名詞", "数", "非自立", "特殊"]:
+                try:
+                    word_list.append(res.surface)
+                except UnicodeDecodeError:
+                    print('デコードエラー→'+pos[0]+pos[1]+pos[2])
+        res = res.next
+    return word_list
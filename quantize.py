@@ -0,0 +1,109 @@
+import numpy as np
+
+from vocab import vocab_fingerprint
+
+
+def quantize_int8(weights):
+    # 出力の列ごとに対称な int8 へ量子化する (weights ≒ q * scale)
+    scale = np.abs(weights).max(axis=0) / 127.0
+    scale[scale == 0] = 1.0
+    q = np.clip(np.round(weights / scale), -127, 127).astype(np.int8)
+    return q, scale.astype(np.float32)
+
+def export_model(model, path, first_layer='int8', vocab=None):
+    # Keras の Dense だけのモデルから、重みと活性化関数を npz に書き出す
+    # 一番大きい最初の層は int8 か float16、残りの層は float16 で保存する
+    # vocab は学習に使った語彙 (vocab_fingerprint を保存し、推論の時に同じ語彙かを確かめる)
+    arrays = {}
+    if vocab is not None:
+        arrays['vocab'] = np.array(vocab_fingerprint(vocab))
+    activations = []
+    for i, layer in enumerate(model.layers):
+        weights, bias = layer.get_weights()
+        activations.append(layer.get_config()['activation'])
+        if i == 0 and first_layer == 'int8':
+            arrays['w0'], arrays['scale0'] = quantize_int8(weights)
+        else:
+            arrays['w{0}'.format(i)] = weights.astype(np.float16)
+        arrays['b{0}'.format(i)] = bias.astype(np.float32)
+    arrays['activations'] = np.array(activations)
+    np.savez(path, **arrays)
+
+
+class NumpyClassifier(object):
+    '''
+    export_model で書き出したモデルを NumPy だけで推論する (Keras を import しない)
+    最初の層は疎な入力 (doc2bow の (id, 出現回数)) のまま、使う行だけを足し合わせる
+    '''
+
+    def __init__(self, path):
+        arrays = np.load(path)
+        self.activations = [str(a) for a in arrays['activations']]
+        n_layers = len(self.activations)
+        self.w0 = arrays['w0']
+        self.vocab = str(arrays['vocab']) if 'vocab' in arrays else None
+        self.scale0 = arrays['scale0'] if 'scale0' in arrays else None
+        self.biases = [arrays['b{0}'.format(i)] for i in range(n_layers)]
+        # 2層目以降は小さいので float32 に戻しておく
+        self.weights = [arrays['w{0}'.format(i)].astype(np.float32) for i in range(1, n_layers)]
+
+    @property
+    def input_dim(self):
+        return self.w0.shape[0]
+
+    def check_vocab(self, dic):
+        # 別の語彙で doc2bow すると、id がずれて IndexError になるか、黙って間違った結果になる
+        if self.input_dim != len(dic):
+            raise ValueError('the engine expects {0} words but the vocabulary has {1}; '
+                             'pass the --vocab used to train it'.format(self.input_dim, len(dic)))
+        if self.vocab is not None and self.vocab != vocab_fingerprint(dic):
+            raise ValueError('the engine was exported with a different vocabulary; pass the --vocab used to train it')
+
+    def first_layer(self, bows):
+        # sum(count * W0[id]) を、文書の区切りで reduceat してまとめて計算する
+        h = np.zeros((len(bows), self.w0.shape[1]), dtype=np.float32)
+        lengths = np.array([len(bow) for bow in bows])
+        nonempty = np.flatnonzero(lengths > 0)
+        if len(nonempty) > 0:
+            ids = np.array([word_id for bow in bows for word_id, _ in bow], dtype=np.int64)
+            counts = np.array([count for bow in bows for _, count in bow], dtype=np.float32)
+            rows = self.w0[ids].astype(np.float32) * counts[:, None]
+            starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])[nonempty]
+            h[nonempty] = np.add.reduceat(rows, starts, axis=0)
+        if self.scale0 is not None:
+            h *= self.scale0
+        return h + self.biases[0]
+
+    def activate(self, h, activation):
+        if activation == 'relu':
+            return np.maximum(h, 0)
+        if activation == 'softmax':
+            e = np.exp(h - h.max(axis=1, keepdims=True))
+            return e / e.sum(axis=1, keepdims=True)
+        if activation == 'linear':
+            return h
+        raise ValueError('unsupported activation: {0}'.format(activation))
+
+    def predict_proba_bow(self, bows):
+        h = self.activate(self.first_layer(bows), self.activations[0])
+        for weights, bias, activation in zip(self.weights, self.biases[1:], self.activations[1:]):
+            h = self.activate(h.dot(weights) + bias, activation)
+        return h
+
+    def predict_proba(self, x):
+        # 密な入力 (make_data_set の x) 用
+        bows = [[(int(i), row[i]) for i in np.flatnonzero(row)] for row in np.asarray(x)]
+        return self.predict_proba_bow(bows)
+
+
+def compare(model, engine, x_test, y_test, batch_size=128):
+    # テストデータで Keras のモデルと NumPy の推論を比べる
+    keras_proba = model.predict(x_test, batch_size=batch_size)
+    numpy_proba = engine.predict_proba(x_test)
+    answer = np.argmax(y_test, axis=1)
+    return {
+        'keras_accuracy': float(np.mean(np.argmax(keras_proba, axis=1) == answer)),
+        'numpy_accuracy': float(np.mean(np.argmax(numpy_proba, axis=1) == answer)),
+        'agreement': float(np.mean(np.argmax(keras_proba, axis=1) == np.argmax(numpy_proba, axis=1))),
+        'max_abs_diff': float(np.abs(keras_proba - numpy_proba).max()),
+    }
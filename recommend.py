@@ -0,0 +1,212 @@
+import argparse
+import multiprocessing
+import os
+import sys
+
+from preprocess import clean_tweet, tokenize
+from embedding_cache import EmbeddingCache, content_hash, model_fingerprint
+from user_index import UserIndex
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(PROJECT_DIR, 'model', 'doc2vec.model')
+INDEX_PATH = os.path.join(PROJECT_DIR, 'model', 'user_index')
+TWEETS_DIR = os.path.join(PROJECT_DIR, 'data', 'tweets')
+
+# ワーカープロセスごとに読み込んだモデルとストア
+_worker = {}
+# (モデルのパス, file_stamp) → モデルのフィンガープリント。モデルが変わらない間はファイルを読み直さない
+_fingerprints = {}
+
+
+def is_store_uri(source):
+    return '://' in source
+
+def open_store(source):
+    from scraper.storage import TweetStore
+    return TweetStore.fromUri(source)
+
+def list_users(source):
+    # source は data/tweets のようなディレクトリか、ツイートストアの uri
+    if is_store_uri(source):
+        store = open_store(source)
+        try:
+            return sorted(store.users())
+        finally:
+            store.close()
+    return sorted(name[:-len('.txt')] for name in os.listdir(source) if name.endswith('.txt'))
+
+def iter_user_tweets(source, user, store=None):
+    # ユーザーのツイートを一件ずつ返す (全件をメモリに載せない)
+    if is_store_uri(source):
+        for tweet in store.iterUser(user, fields=['text']):
+            yield clean_tweet(tweet['text'])
+    else:
+        with open(os.path.join(source, user + '.txt')) as f:
+            for line in f:
+                line = line.strip()
+                if line != '':
+                    yield line
+
+def user_words(tweets):
+    words = []
+    for tweet in tweets:
+        words.extend(tokenize(tweet))
+    return words
+
+def require_model(model_path):
+    if not os.path.exists(model_path):
+        raise ValueError('{0} not found; train it with `python train_doc2vec.py --model {0}`'.format(model_path))
+
+def load_model(model_path):
+    import pickle
+    from gensim.models.doc2vec import Doc2Vec
+    require_model(model_path)
+    try:
+        return Doc2Vec.load(model_path)
+    except (AttributeError, ImportError, pickle.UnpicklingError) as e:
+        # 古い gensim で保存されたモデル (元の model/doc2vec.model など) は今の gensim では読めない
+        raise ValueError('{0} cannot be loaded with this gensim ({1}); '
+                         'retrain it with `python train_doc2vec.py --retrain --model {0}`'.format(model_path, e))
+
+def cached_fingerprint(model_path, stamp):
+    key = (model_path, stamp)
+    if key not in _fingerprints:
+        _fingerprints[key] = model_fingerprint(model_path)
+    return _fingerprints[key]
+
+def _load_worker_model(model_path, cache_dir=None, stamp=None, fingerprint=None):
+    # 同じプロセスで同じモデルを使い続ける時は、モデルとメモリ上のキャッシュを使い回す
+    # stamp と fingerprint は親プロセスで一度だけ求めたものを受け取る
+    stamp = stamp or file_stamp(model_path)
+    if _worker.get('model_stamp') != (model_path, stamp, cache_dir):
+        fingerprint = fingerprint or cached_fingerprint(model_path, stamp)
+        _worker['model'] = load_model(model_path)
+        _worker['cache'] = EmbeddingCache(model_path, cache_dir, fingerprint=fingerprint)
+        _worker['model_stamp'] = (model_path, stamp, cache_dir)
+
+def _init_worker(model_path, source, cache_dir=None, stamp=None, fingerprint=None):
+    _load_worker_model(model_path, cache_dir, stamp, fingerprint)
+    if _worker.get('source') != source:
+        if _worker.get('store') is not None:
+            _worker['store'].close()
+        _worker['source'] = source
+        _worker['store'] = open_store(source) if is_store_uri(source) else None
+
+def _infer_user(user):
+    tweets = list(iter_user_tweets(_worker['source'], user, _worker['store']))
+    # 同じツイートなら、分かち書きも infer_vector もせずにキャッシュから返す
+    key = content_hash(tweets)
+    vector = _worker['cache'].get(key)
+    if vector is not None:
+        return user, vector
+    words = user_words(tweets)
+    if len(words) == 0:
+        return user, None
+    vector = _worker['model'].infer_vector(words)
+    _worker['cache'].put(key, vector)
+    return user, vector
+
+def cache_dir_for(model_path):
+    # infer_vector のキャッシュはモデルごとに、モデルの横に置く (他のモデルのキャッシュを消さない)
+    return model_path + '.cache'
+
+def infer_user_vectors(users, source=TWEETS_DIR, model_path=MODEL_PATH, workers=1, chunksize=4, cache_dir=None):
+    # ユーザーごとに分かち書きと infer_vector を行い、{user: vector} を返す
+    # ツイートが一件もないユーザーは除く
+    # キャッシュのメモリ上の段が効くのは workers=1 で同じプロセスから何度も呼ぶ時だけ
+    # (workers>1 のワーカーは呼び出しごとに終わるので、ディスクの段だけが次の呼び出しに残る)
+    cache_dir = cache_dir or cache_dir_for(model_path)
+    # モデルのハッシュはここで一度だけ計算し、ワーカーに渡す
+    require_model(model_path)
+    stamp = file_stamp(model_path)
+    fingerprint = cached_fingerprint(model_path, stamp)
+    # モデルは親プロセスで読んでおく。読めないモデルはここで ValueError になり
+    # (ワーカーの initializer で失敗すると Pool がワーカーを作り直し続ける)、fork したワーカーは読み直さない
+    _load_worker_model(model_path, cache_dir, stamp, fingerprint)
+    # 再学習する前のモデルのキャッシュはもう使わないので消す
+    EmbeddingCache(model_path, cache_dir, maxsize=0, fingerprint=fingerprint).invalidate_stale()
+    if workers <= 1:
+        _init_worker(model_path, source, cache_dir, stamp, fingerprint)
+        results = [_infer_user(user) for user in users]
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                    initargs=(model_path, source, cache_dir, stamp, fingerprint))
+        try:
+            results = list(pool.imap_unordered(_infer_user, users, chunksize=chunksize))
+        finally:
+            pool.close()
+            pool.join()
+    return dict((user, vector) for user, vector in results if vector is not None)
+
+def file_stamp(path):
+    st = os.stat(path)
+    return '{0}-{1}'.format(st.st_mtime_ns, st.st_size)
+
+def user_stamps(source, users, model_path=MODEL_PATH):
+    # モデルかユーザーのツイートが変わると値が変わる
+    model_stamp = file_stamp(model_path)
+    if is_store_uri(source):
+        store = open_store(source)
+        try:
+            return dict((user, '{0}:{1}'.format(model_stamp, store.maxId(user))) for user in users)
+        finally:
+            store.close()
+    return dict((user, '{0}:{1}'.format(model_stamp, file_stamp(os.path.join(source, user + '.txt'))))
+                for user in users)
+
+def update_index(index, source=TWEETS_DIR, model_path=MODEL_PATH, workers=1):
+    # ツイートが変わったユーザーだけ推論し直し、いなくなったユーザーは消す
+    require_model(model_path)
+    users = list_users(source)
+    stamps = user_stamps(source, users, model_path)
+    changed = [user for user in users if index.stamp(user) != stamps[user]]
+    if len(changed) > 0:
+        vectors = infer_user_vectors(changed, source, model_path, workers)
+        index.add(vectors, dict((user, stamps[user]) for user in vectors))
+        # 分かち書きすると単語が無くなるユーザーは、古いベクトルを消して stamp だけ残す (毎回推論し直さない)
+        empty = [user for user in changed if user not in vectors]
+        index.remove(empty)
+        index.stamps.update((user, stamps[user]) for user in empty)
+    current = set(users)
+    index.remove([user for user in set(index.ids) | set(index.stamps) if user not in current])
+    return changed
+
+def recommend(target, source=TWEETS_DIR, model_path=MODEL_PATH, topn=5, workers=1, index_path=None,
+              approximate=False):
+    # index_path を指定すると、ユーザーベクトルを保存して次回以降は変わったユーザーだけ推論する
+    if index_path is not None and os.path.exists(index_path + '.json'):
+        index = UserIndex.load(index_path)
+    else:
+        index = UserIndex()
+    update_index(index, source, model_path, workers)
+    if index_path is not None:
+        index.save(index_path)
+    if target not in index:
+        raise ValueError('unknown user or no tweets: {0}'.format(target))
+    return index.search(index.vector(target), topn, exclude=[target], approximate=approximate)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='doc2vecで似ているユーザーをレコメンドする')
+    parser.add_argument('target', nargs='?', help='レコメンドの対象のユーザー (省略するとインデックスの更新だけ)')
+    parser.add_argument('-n', '--topn', type=int, default=5)
+    parser.add_argument('--source', default=TWEETS_DIR, help='data/tweets のようなディレクトリか、ツイートストアの uri')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--index', default=INDEX_PATH, help='ユーザーベクトルの保存先 (拡張子なし)')
+    parser.add_argument('--approximate', action='store_true', help='LSHで候補を絞って探す (ユーザーが多い時)')
+    args = parser.parse_args()
+
+    try:
+        if args.target is None:
+            index = UserIndex.load(args.index) if os.path.exists(args.index + '.json') else UserIndex()
+            changed = update_index(index, args.source, args.model, args.workers)
+            index.save(args.index)
+            print('updated {0} of {1} users in {2}'.format(len(changed), len(index), args.index))
+        else:
+            results = recommend(args.target, args.source, args.model, args.topn, args.workers, args.index,
+                                args.approximate)
+            for user, similarity in results:
+                print('{0}\t{1:.4f}'.format(user, similarity))
+    except ValueError as e:
+        sys.exit('error: {0}'.format(e))
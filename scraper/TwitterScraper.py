@@ -1,18 +1,23 @@
 # -*- coding: utf-8 -*-
+import argparse
 import os
-from requests_oauthlib import OAuth1Session
-import json
+from transport import Transport
+from storage import projectDoc
 import yaml
 import datetime, time, sys
 from abc import ABCMeta, abstractmethod
-from pymongo import MongoClient
+from storage import TweetStore, loadStoreUri
 
 
 class TweetsGetter(object):
     __metaclass__ = ABCMeta
 
-    def __init__(self, CS, CK, AT, AS):
-        self.session = OAuth1Session(CK, CS, AT, AS)
+    def __init__(self, CS, CK, AT, AS, transport=None, fields=None):
+        # transport を渡せば、複数のユーザーでコネクションを使い回せる
+        self.transport = transport or Transport(CS, CK, AT, AS)
+        self.session = self.transport.session
+        # fields を指定すると、ツイートのうちそのフィールドだけを残して返す ('user.screen_name' のように指定)
+        self.fields = fields
 
     @abstractmethod
     def specifyUrlAndParams(self, keyword):
@@ -53,25 +58,12 @@ class TweetsGetter(object):
         # ツイート取得
         # ----------------
         cnt = 0
-        unavailableCnt = 0
         while True:
-            res = self.session.get(url, params=params)
-            if res.status_code == 503:
-                # 503 : Service Unavailable
-                if unavailableCnt > 10:
-                    raise Exception('Twitter API error %d' % res.status_code)
+            # 一時的なエラー (429, 5xx, 接続エラー) は transport 側で待ってやり直す
+            res = self.transport.get(url, params=params)
 
-                unavailableCnt += 1
-                print ('Service Unavailable 503')
-                self.waitUntilReset(time.mktime(datetime.datetime.now().timetuple()) + 30)
-                continue
-
-            unavailableCnt = 0
-
-            if res.status_code != 200:
-                raise Exception('Twitter API error %d' % res.status_code)
-
-            tweets = self.pickupTweet(json.loads(res.text))
+            # JSON のパースはレスポンスごとに 1 回だけ
+            tweets = self.pickupTweet(res.json())
             if len(tweets) == 0:
                 # len(tweets) != params['count'] としたいが
                 # count は最大値らしいので判定に使えない。
@@ -86,7 +78,7 @@ class TweetsGetter(object):
                     if onlyText is True:
                         yield tweet['text']
                     else:
-                        yield tweet
+                        yield projectDoc(tweet, self.fields)
 
                     cnt += 1
                     if cnt % 100 == 0:
@@ -111,27 +103,11 @@ class TweetsGetter(object):
         '''
         回数制限を問合せ、アクセス可能になるまで wait する
         '''
-        unavailableCnt = 0
         while True:
             url = "https://api.twitter.com/1.1/application/rate_limit_status.json"
-            res = self.session.get(url)
-
-            if res.status_code == 503:
-                # 503 : Service Unavailable. Twitter is now busy. Try later
-                if unavailableCnt > 10:
-                    raise Exception('Twitter API error %d' % res.status_code)
-
-                unavailableCnt += 1
-                print ('Service Unavailable 503')
-                self.waitUntilReset(time.mktime(datetime.datetime.now().timetuple()) + 30)
-                continue
+            res = self.transport.get(url)
 
-            unavailableCnt = 0
-
-            if res.status_code != 200:
-                raise Exception('Twitter API error %d' % res.status_code)
-
-            remaining, reset = self.getLimitContext(json.loads(res.text))
+            remaining, reset = self.getLimitContext(res.json())
             if (remaining == 0):
                 self.waitUntilReset(reset)
             else:
@@ -150,20 +126,20 @@ class TweetsGetter(object):
         time.sleep(seconds + 10)  # 念のため + 10 秒
 
     @staticmethod
-    def bySearch(keyword, CS, CK, AT, AS):
-        return TweetsGetterBySearch(keyword, CS, CK, AT, AS)
+    def bySearch(keyword, CS, CK, AT, AS, transport=None, fields=None):
+        return TweetsGetterBySearch(keyword, CS, CK, AT, AS, transport, fields)
 
     @staticmethod
-    def byUser(screen_name, since_id, CS, CK, AT, AS):
-        return TweetsGetterByUser(screen_name, since_id, CS, CK, AT, AS)
+    def byUser(screen_name, since_id, CS, CK, AT, AS, transport=None, fields=None):
+        return TweetsGetterByUser(screen_name, since_id, CS, CK, AT, AS, transport, fields)
 
 class TweetsGetterBySearch(TweetsGetter):
     '''
     キーワードでツイートを検索
     '''
 
-    def __init__(self, keyword, CS, CK, AT, AS):
-        super(TweetsGetterBySearch, self).__init__(CS, CK, AT, AS)
+    def __init__(self, keyword, CS, CK, AT, AS, transport=None, fields=None):
+        super(TweetsGetterBySearch, self).__init__(CS, CK, AT, AS, transport, fields)
         self.keyword = keyword
 
     def specifyUrlAndParams(self):
@@ -199,8 +175,8 @@ class TweetsGetterByUser(TweetsGetter):
     ユーザーを指定してツイートを取得
     '''
 
-    def __init__(self, screen_name, since_id, CS, CK, AT, AS):
-        super(TweetsGetterByUser, self).__init__(CS, CK, AT, AS)
+    def __init__(self, screen_name, since_id, CS, CK, AT, AS, transport=None, fields=None):
+        super(TweetsGetterByUser, self).__init__(CS, CK, AT, AS, transport, fields)
         self.screen_name = screen_name
         self.since_id = since_id
 
@@ -233,6 +209,11 @@ class TweetsGetterByUser(TweetsGetter):
 
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser(description='config/input.yml のユーザーのツイートを取得してストアに保存する')
+    parser.add_argument('--store', default=None,
+                        help='ツイートストアの uri (省略時は config/storage.yml、それも無ければ mongodb://localhost:27017/by_user_database)')
+    args = parser.parse_args()
+
     app_yml_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 'config', 'twitter_app.yml'))
     
     with open(app_yml_path) as f:
@@ -249,38 +230,42 @@ if __name__ == '__main__':
     with open(input_yml_path) as f:
         inputs = yaml.safe_load(f.read())
 
-    # コネクション作成
-    client = MongoClient('localhost', 27017)
+    # ストアの作成 (config/storage.yml で sqlite:///... を指定すれば DB サーバーなしで動く)
+    store_uri = args.store or loadStoreUri(os.path.join(os.path.dirname(__file__), 'config'),
+                                           'mongodb://localhost:27017/by_user_database')
+    store = TweetStore.fromUri(store_uri)
+    # 全ユーザーで 1 つの transport を使い、温まったコネクションを使い回す
+    transport = Transport(CS, CK, AT, AS)
+    # 後段で使うフィールドだけを保存する
+    fields = ['id', 'text', 'user.screen_name', 'user.name']
     
 #     byUserの検索
     byUser = 1
     for each_name in range(len(inputs[byUser])):
-        # コネクションから特定ユーザ用のデータベースを取得
-        db = client['by_user_database']
-        # データベースからコレクションを取得
-        collection = db[inputs[byUser][each_name]['collection_name']]
+        user = inputs[byUser][each_name]['collection_name']
         
 #         tweetのIDの最大値を取得
-        doc = list(collection.find({}, {'_id': False, 'id': True}).sort("id", -1).limit(1))
+        since_id = store.maxId(user)
         
     #   TODO DBが初期化されている場合、最初から取ってくると死んじゃうので適当な所から。
-        if len(doc) == 0:
+        if since_id is None:
             since_id = 700000000000000000
-    #   DBにデータがある場合
-        if len(doc) != 0:
-            since_id = doc[0]['id']
         
-        # ジェネレータから次々取ってきてDBに保存
-        getter = TweetsGetter.byUser(inputs[byUser][each_name]['screen_name'], since_id, CS, CK, AT, AS)
-        all_tweets = getter.collect()
-        for tweet in list(all_tweets):
-            collection.insert_one(tweet)
+        # ジェネレータから次々取ってきて、まとめてDBに保存
+        getter = TweetsGetter.byUser(inputs[byUser][each_name]['screen_name'], since_id, CS, CK, AT, AS, transport, fields)
+        batch = []
+        for tweet in getter.collect():
+            batch.append(tweet)
+            if len(batch) >= 1000:
+                store.insertMany(user, batch)
+                batch = []
+        store.insertMany(user, batch)
         
         # 取ってきたtweetのユーザ名と次回取ってくるidを取得
-        doc_after = list(collection.find({}).sort('id', -1).limit(1))
-        if len(doc_after) != 0:    
-            print('name:', doc_after[0]['user']['name'])
-            next_since_id = doc_after[0]['id']
+        for doc_after in store.findByIdRange(user, fields=['id', 'user.name'], batchSize=1):
+            print('name:', doc_after['user']['name'])
+            next_since_id = doc_after['id']
             print('next_since_id:',next_since_id)
-        
-
+            break
+    store.close()
+    print('latency:', transport.latencyStats())
@@ -5,8 +5,8 @@ Created on Dec 2, 2017
 '''
 # -*- coding: utf-8 -*-
 
-from requests_oauthlib import OAuth1Session
-import json
+from transport import Transport
+from storage import projectDoc
 import yaml
 import csv
 import datetime, time, sys
@@ -18,8 +18,12 @@ from pymongo import MongoClient
 class TweetsGetter(object):
     __metaclass__ = ABCMeta
 
-    def __init__(self, CS, CK, AT, AS):
-        self.session = OAuth1Session(CK, CS, AT, AS)
+    def __init__(self, CS, CK, AT, AS, transport=None, fields=None):
+        # transport を渡せば、複数のユーザーでコネクションを使い回せる
+        self.transport = transport or Transport(CS, CK, AT, AS)
+        self.session = self.transport.session
+        # fields を指定すると、ツイートのうちそのフィールドだけを残して返す ('user.screen_name' のように指定)
+        self.fields = fields
 
     @abstractmethod
     def specifyUrlAndParams(self, keyword):
@@ -60,32 +64,20 @@ class TweetsGetter(object):
         # ツイート取得
         # ----------------
         cnt = 0
-        unavailableCnt = 0
         while True:
-            res = self.session.get(url, params=params)
-            if res.status_code == 503:
-                # 503 : Service Unavailable
-                if unavailableCnt > 10:
-                    raise Exception('Twitter API error %d' % res.status_code)
-
-                unavailableCnt += 1
-                print ('Service Unavailable 503')
-                self.waitUntilReset(time.mktime(datetime.datetime.now().timetuple()) + 30)
-                continue
-
-            unavailableCnt = 0
-
-            if res.status_code != 200:
-                raise Exception('Twitter API error %d' % res.status_code)
+            # 一時的なエラー (429, 5xx, 接続エラー) は transport 側で待ってやり直す
+            res = self.transport.get(url, params=params)
+            
+            # JSON のパースはレスポンスごとに 1 回だけ
+            res_json = res.json()
             
             # followerのリストをゲットする時
-#             if 'users' in json.loads(res.text).keys():
-            if 'users' in json.loads(res.text):
-                follower_data = json.loads(res.text)
+            if 'users' in res_json:
+                follower_data = res_json
                 yield follower_data
                 return
             else:
-                tweets = self.pickupTweet(json.loads(res.text))
+                tweets = self.pickupTweet(res_json)
             
             if len(tweets) == 0:
                 # len(tweets) != params['count'] としたいが
@@ -102,7 +94,7 @@ class TweetsGetter(object):
                     if onlyText is True:
                         yield tweet['text']
                     else:
-                        yield tweet
+                        yield projectDoc(tweet, self.fields)
 
                     cnt += 1
                     if cnt % 100 == 0:
@@ -127,27 +119,11 @@ class TweetsGetter(object):
         '''
         回数制限を問合せ、アクセス可能になるまで wait する
         '''
-        unavailableCnt = 0
         while True:
             url = "https://api.twitter.com/1.1/application/rate_limit_status.json"
-            res = self.session.get(url)
-            
-            if res.status_code == 503:
-                # 503 : Service Unavailable. Twitter is now busy. Try later
-                if unavailableCnt > 10:
-                    raise Exception('Twitter API error %d' % res.status_code)
-
-                unavailableCnt += 1
-                print ('Service Unavailable 503')
-                self.waitUntilReset(time.mktime(datetime.datetime.now().timetuple()) + 30)
-                continue
-
-            unavailableCnt = 0
-
-            if res.status_code != 200:
-                raise Exception('Twitter API error %d' % res.status_code)
+            res = self.transport.get(url)
 
-            remaining, reset = self.getLimitContext(json.loads(res.text))
+            remaining, reset = self.getLimitContext(res.json())
             if (remaining == 0):
                 self.waitUntilReset(reset)
             else:
@@ -166,16 +142,16 @@ class TweetsGetter(object):
         time.sleep(seconds + 10)  # 念のため + 10 秒
 
     @staticmethod
-    def bySearch(keyword, since_id, CS, CK, AT, AS):
-        return TweetsGetterBySearch(keyword, since_id, CS, CK, AT, AS)
+    def bySearch(keyword, since_id, CS, CK, AT, AS, transport=None, fields=None):
+        return TweetsGetterBySearch(keyword, since_id, CS, CK, AT, AS, transport, fields)
 
     @staticmethod
-    def byUser(screen_name, since_id, CS, CK, AT, AS):
-        return TweetsGetterByUser(screen_name, since_id, CS, CK, AT, AS)
+    def byUser(screen_name, since_id, CS, CK, AT, AS, transport=None, fields=None):
+        return TweetsGetterByUser(screen_name, since_id, CS, CK, AT, AS, transport, fields)
     
     @staticmethod
-    def byFollower(screen_name, count, CS, CK, AT, AS):
-        return TweetsGetterByFollower(screen_name, count, CS, CK, AT, AS)
+    def byFollower(screen_name, count, CS, CK, AT, AS, transport=None, fields=None):
+        return TweetsGetterByFollower(screen_name, count, CS, CK, AT, AS, transport, fields)
 
 
 class TweetsGetterBySearch(TweetsGetter):
@@ -183,8 +159,8 @@ class TweetsGetterBySearch(TweetsGetter):
     キーワードでツイートを検索
     '''
 
-    def __init__(self, keyword, since_id, CS, CK, AT, AS):
-        super(TweetsGetterBySearch, self).__init__(CS, CK, AT, AS)
+    def __init__(self, keyword, since_id, CS, CK, AT, AS, transport=None, fields=None):
+        super(TweetsGetterBySearch, self).__init__(CS, CK, AT, AS, transport, fields)
         self.keyword = keyword
         self.since_id = since_id
         self.result_type = 'recent'
@@ -223,8 +199,8 @@ class TweetsGetterByUser(TweetsGetter):
     ユーザーを指定してツイートを取得
     '''
 
-    def __init__(self, screen_name, since_id, CS, CK, AT, AS):
-        super(TweetsGetterByUser, self).__init__(CS, CK, AT, AS)
+    def __init__(self, screen_name, since_id, CS, CK, AT, AS, transport=None, fields=None):
+        super(TweetsGetterByUser, self).__init__(CS, CK, AT, AS, transport, fields)
         self.screen_name = screen_name
         self.since_id = since_id
 
@@ -260,8 +236,8 @@ class TweetsGetterByFollower(TweetsGetter):
     ユーザーを指定して、フォロワーのツイートを取得
     '''
     
-    def __init__(self, screen_name, count, CS, CK, AT, AS):
-        super(TweetsGetterByFollower, self).__init__(CS, CK, AT, AS)
+    def __init__(self, screen_name, count, CS, CK, AT, AS, transport=None, fields=None):
+        super(TweetsGetterByFollower, self).__init__(CS, CK, AT, AS, transport, fields)
         self.screen_name = screen_name
         self.count = count
     
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import sqlite3
+from abc import ABCMeta, abstractmethod
+
+
+def projectDoc(doc, fields):
+    '''
+    doc から fields (ドット区切りのパス) だけを残した dict を返す
+    fields が None の時は doc をそのまま返す
+    '''
+    if fields is None:
+        return doc
+    result = {}
+    for field in fields:
+        src, dst = doc, result
+        keys = field.split('.')
+        for key in keys[:-1]:
+            if not isinstance(src, dict) or key not in src:
+                break
+            src = src[key]
+            dst = dst.setdefault(key, {})
+        else:
+            if isinstance(src, dict) and keys[-1] in src:
+                dst[keys[-1]] = src[keys[-1]]
+    return result
+
+
+class TweetStore(object):
+    '''
+    ユーザーごとにツイートを保存するストレージのインターフェース
+    '''
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def insertMany(self, user, tweets):
+        '''
+        tweets をまとめて user に保存し、保存した件数を返す
+        '''
+
+    @abstractmethod
+    def findByIdRange(self, user, since_id=None, max_id=None, fields=None, batchSize=1000):
+        '''
+        since_id < id <= max_id のツイートを id の降順に返す
+        '''
+
+    @abstractmethod
+    def users(self):
+        '''
+        保存されているユーザーの一覧を返す
+        '''
+
+    @abstractmethod
+    def saveUserStats(self, user, name, stats):
+        '''
+        user について集計した結果 (dict) を name という名前で保存する
+        '''
+
+    @abstractmethod
+    def loadUserStats(self, user, name):
+        '''
+        saveUserStats で保存した結果を返す (無ければ None)
+        '''
+
+    def iterUser(self, user, fields=None, batchSize=1000):
+        '''
+        user のツイートを id の降順に少しずつ返す
+        '''
+        return self.findByIdRange(user, fields=fields, batchSize=batchSize)
+
+    def maxId(self, user):
+        '''
+        user の保存済みツイートの id の最大値を返す (無ければ None)
+        '''
+        for tweet in self.findByIdRange(user, fields=['id'], batchSize=1):
+            return tweet['id']
+        return None
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def byMongo(dbName, host='localhost', port=27017):
+        return MongoTweetStore(dbName, host, port)
+
+    @staticmethod
+    def bySQLite(path):
+        return SQLiteTweetStore(path)
+
+    @staticmethod
+    def fromUri(uri):
+        '''
+        mongodb://host:port/dbName または sqlite:///path/to/file からストアを作成
+        '''
+        if uri.startswith('sqlite:///'):
+            return TweetStore.bySQLite(uri[len('sqlite:///'):])
+        if uri.startswith('mongodb://'):
+            location, _, dbName = uri[len('mongodb://'):].partition('/')
+            host, _, port = location.partition(':')
+            return TweetStore.byMongo(dbName, host or 'localhost', int(port or 27017))
+        raise ValueError('unknown tweet store uri: %s' % uri)
+
+
+class MongoTweetStore(TweetStore):
+    '''
+    MongoDB に保存する (ユーザーごとに 1 コレクション)
+    '''
+
+    def __init__(self, dbName, host='localhost', port=27017):
+        from pymongo import MongoClient
+        self.client = MongoClient(host, port)
+        self.db = self.client[dbName]
+        # 集計結果はユーザーのコレクションと混ざらないように別の DB に置く
+        self.statsDb = self.client[dbName + '_stats']
+
+    def insertMany(self, user, tweets):
+        # insert_many は渡した dict に _id を書き込むのでコピーを渡す
+        docs = [dict(tweet) for tweet in tweets]
+        if len(docs) == 0:
+            return 0
+        self.db[user].insert_many(docs, ordered=False)
+        return len(docs)
+
+    def findByIdRange(self, user, since_id=None, max_id=None, fields=None, batchSize=1000):
+        query = {}
+        if since_id is not None:
+            query.setdefault('id', {})['$gt'] = since_id
+        if max_id is not None:
+            query.setdefault('id', {})['$lte'] = max_id
+        projection = None
+        if fields is not None:
+            projection = dict((field, True) for field in fields)
+            projection['_id'] = False
+        cursor = self.db[user].find(query, projection).sort('id', -1).batch_size(batchSize)
+        for tweet in cursor:
+            yield tweet
+
+    def users(self):
+        return self.db.list_collection_names()
+
+    def saveUserStats(self, user, name, stats):
+        doc = dict(stats)
+        doc['user'] = user
+        self.statsDb[name].replace_one({'user': user}, doc, upsert=True)
+
+    def loadUserStats(self, user, name):
+        return self.statsDb[name].find_one({'user': user}, {'_id': False, 'user': False})
+
+    def close(self):
+        self.client.close()
+
+
+class SQLiteTweetStore(TweetStore):
+    '''
+    DB サーバーなしで動くように SQLite (WAL モード) に保存する
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS tweets ('
+            ' user TEXT NOT NULL, id INTEGER NOT NULL, doc TEXT NOT NULL,'
+            ' PRIMARY KEY (user, id)) WITHOUT ROWID')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS user_stats ('
+            ' user TEXT NOT NULL, name TEXT NOT NULL, doc TEXT NOT NULL,'
+            ' PRIMARY KEY (user, name)) WITHOUT ROWID')
+        self.conn.commit()
+
+    def insertMany(self, user, tweets):
+        rows = [(user, tweet['id'], json.dumps(tweet, ensure_ascii=False)) for tweet in tweets]
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO tweets (user, id, doc) VALUES (?, ?, ?)', rows)
+        return len(rows)
+
+    def findByIdRange(self, user, since_id=None, max_id=None, fields=None, batchSize=1000):
+        sql = 'SELECT doc FROM tweets WHERE user = ?'
+        args = [user]
+        if since_id is not None:
+            sql += ' AND id > ?'
+            args.append(since_id)
+        if max_id is not None:
+            sql += ' AND id <= ?'
+            args.append(max_id)
+        sql += ' ORDER BY id DESC'
+        cursor = self.conn.execute(sql, args)
+        while True:
+            rows = cursor.fetchmany(batchSize)
+            if len(rows) == 0:
+                break
+            for row in rows:
+                yield projectDoc(json.loads(row[0]), fields)
+
+    def maxId(self, user):
+        row = self.conn.execute('SELECT MAX(id) FROM tweets WHERE user = ?', (user,)).fetchone()
+        return row[0]
+
+    def users(self):
+        return [row[0] for row in self.conn.execute('SELECT DISTINCT user FROM tweets ORDER BY user')]
+
+    def saveUserStats(self, user, name, stats):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO user_stats (user, name, doc) VALUES (?, ?, ?)',
+                              (user, name, json.dumps(stats, ensure_ascii=False)))
+
+    def loadUserStats(self, user, name):
+        row = self.conn.execute('SELECT doc FROM user_stats WHERE user = ? AND name = ?', (user, name)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def close(self):
+        self.conn.close()
+
+
+def loadStoreUri(config_dir, default):
+    '''
+    config/storage.yml の uri を読む (無ければ default)
+    '''
+    path = os.path.join(config_dir, 'storage.yml')
+    if not os.path.exists(path):
+        return default
+    import yaml
+    with open(path) as f:
+        config = yaml.safe_load(f.read()) or {}
+    return config.get('uri', default)
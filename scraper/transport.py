@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import collections
+import random
+import sys
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests_oauthlib import OAuth1Session
+
+
+class TwitterAPIError(Exception):
+    def __init__(self, status_code):
+        super(TwitterAPIError, self).__init__('Twitter API error %d' % status_code)
+        self.status_code = status_code
+
+
+class RetryPolicy(object):
+    '''
+    ステータスの種類ごとに、ジッター付きの指数バックオフで待ち時間を決める
+    '''
+
+    # 種類: (初回の待ち時間 [秒], 待ち時間の上限 [秒])
+    DEFAULT_BACKOFF = {
+        'rate_limit': (60, 900),
+        'server': (5, 120),
+        'connection': (2, 60),
+    }
+
+    def __init__(self, maxRetries=10, backoff=None):
+        self.maxRetries = maxRetries
+        self.backoff = dict(self.DEFAULT_BACKOFF)
+        if backoff is not None:
+            self.backoff.update(backoff)
+
+    @staticmethod
+    def classify(status_code):
+        '''
+        ステータスコードからリトライの種類を返す (リトライしない時は None)
+        '''
+        if status_code in (420, 429):
+            return 'rate_limit'
+        if status_code in (500, 502, 503, 504):
+            return 'server'
+        return None
+
+    def delay(self, kind, attempt, res=None):
+        '''
+        attempt 回目のリトライまでの待ち時間を返す
+        '''
+        # 回数制限はリセット時刻がわかればそこまで待つ
+        if kind == 'rate_limit' and res is not None and 'X-Rate-Limit-Reset' in res.headers:
+            return max(int(res.headers['X-Rate-Limit-Reset']) - time.time(), 0) + random.uniform(0, 5)
+        base, cap = self.backoff[kind]
+        return random.uniform(base / 2.0, min(cap, base * (2 ** attempt)))
+
+
+class Transport(object):
+    '''
+    コネクションプールを使い回す HTTP 層 (gzip, keep-alive, リトライ, レイテンシの記録)
+    '''
+
+    def __init__(self, CS, CK, AT, AS, poolSize=10, timeout=(5, 30), policy=None, maxRecords=10000):
+        self.session = OAuth1Session(CK, CS, AT, AS)
+        adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+        self.timeout = timeout
+        self.policy = policy or RetryPolicy()
+        # (url, status_code, 秒) を新しい順に maxRecords 件まで残す
+        self.latencies = collections.deque(maxlen=maxRecords)
+
+    def get(self, url, params=None):
+        '''
+        url を GET し、200 のレスポンスを返す。一時的なエラーは待ってからやり直す
+        '''
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                res = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.latencies.append((url, None, time.time() - start))
+                kind, res = 'connection', None
+                print('Connection error: %s' % e)
+            else:
+                self.latencies.append((url, res.status_code, time.time() - start))
+                if res.status_code == 200:
+                    return res
+                kind = self.policy.classify(res.status_code)
+                if kind is None:
+                    raise TwitterAPIError(res.status_code)
+                print('Twitter API error %d' % res.status_code)
+
+            if attempt >= self.policy.maxRetries:
+                if res is None:
+                    raise TwitterAPIError(0)
+                raise TwitterAPIError(res.status_code)
+            self.wait(self.policy.delay(kind, attempt, res))
+            attempt += 1
+
+    def wait(self, seconds):
+        print('     == retry after %d sec ==' % seconds)
+        sys.stdout.flush()
+        time.sleep(seconds)
+
+    def latencyStats(self):
+        '''
+        記録したレイテンシの件数、平均、中央値、95パーセンタイルを返す
+        '''
+        seconds = sorted(latency for _, _, latency in self.latencies)
+        if len(seconds) == 0:
+            return {'count': 0}
+        return {
+            'count': len(seconds),
+            'mean': sum(seconds) / len(seconds),
+            'p50': seconds[len(seconds) // 2],
+            'p95': seconds[min(int(len(seconds) * 0.95), len(seconds) - 1)],
+        }
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import time
+
+import numpy as np
+
+
+def file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def stratified_split(labels, test_size=0.2, seed=0):
+    # ラベルごとに同じ割合でテストデータを選ぶ。seed が同じなら毎回同じ分け方になる
+    labels = np.asarray(labels)
+    rng = np.random.RandomState(seed)
+    train, test = [], []
+    for label in np.unique(labels):
+        indices = rng.permutation(np.flatnonzero(labels == label))
+        n_test = int(round(len(indices) * test_size))
+        test.append(indices[:n_test])
+        train.append(indices[n_test:])
+    return np.sort(np.concatenate(train)), np.sort(np.concatenate(test))
+
+
+class SplitManifest(object):
+    '''
+    学習・評価・ベンチマークで使い回す、固定のデータの分け方
+    path.npz にインデックスの配列を、path.json に作り方とコーパスのハッシュを保存する
+    '''
+
+    def __init__(self, train, test, meta):
+        self.train = train
+        self.test = test
+        self.meta = meta
+
+    @classmethod
+    def create(cls, labels, corpus_path, test_size=0.2, seed=0):
+        train, test = stratified_split(labels, test_size, seed)
+        meta = {
+            'seed': seed,
+            'test_size': test_size,
+            'n_docs': len(labels),
+            'corpus': file_hash(corpus_path),
+        }
+        meta['split'] = hashlib.sha1(train.tobytes() + test.tobytes()).hexdigest()
+        return cls(train, test, meta)
+
+    @classmethod
+    def load(cls, path):
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        arrays = np.load(path + '.npz')
+        return cls(arrays['train'], arrays['test'], meta)
+
+    def save(self, path):
+        np.savez(path + '.npz', train=self.train, test=self.test)
+        with open(path + '.json', 'w') as f:
+            json.dump(self.meta, f, indent=2)
+
+    def check(self, corpus_path):
+        # コーパスを作り直した後に古い分け方を使わないように確かめる
+        if self.meta['corpus'] != file_hash(corpus_path):
+            raise ValueError('{0} has changed since the split was made; run `classify.py split --force`'.format(corpus_path))
+
+
+def run_fingerprint(manifest, dic_path):
+    # コーパス・辞書・分け方がすべて同じ実行同士だけを比べられるようにする
+    fingerprint = {
+        'corpus': manifest.meta['corpus'],
+        'dictionary': file_hash(dic_path),
+        'split': manifest.meta['split'],
+    }
+    fingerprint['run'] = hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    return fingerprint
+
+def record_run(runs_path, command, fingerprint, **results):
+    record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'command': command, 'fingerprint': fingerprint}
+    record.update(results)
+    with open(runs_path, 'a') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    return record
@@ -0,0 +1,18 @@
+import subprocess
+import sys
+
+from classify import IMPORT_TIME_BUDGET_MS, PROJECT_DIR, import_time_ms
+
+HEAVY_MODULES = ['keras', 'tensorflow', 'gensim', 'sklearn', 'MeCab']
+
+
+def test_import_time_within_budget():
+    elapsed = import_time_ms()
+    assert elapsed < IMPORT_TIME_BUDGET_MS, 'import classify took {0:.1f} ms'.format(elapsed)
+
+def test_import_does_not_load_heavy_modules():
+    # このプロセスでは他のテストが gensim などを import しているので、新しいプロセスで確かめる
+    code = 'import sys, classify; print(" ".join(m for m in {0!r} if m in sys.modules))'.format(HEAVY_MODULES)
+    res = subprocess.run([sys.executable, '-c', code], cwd=PROJECT_DIR, stdout=subprocess.PIPE,
+                         universal_newlines=True, check=True)
+    assert res.stdout.split() == []
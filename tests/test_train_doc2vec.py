@@ -0,0 +1,64 @@
+import os
+import random
+import shutil
+
+import pytest
+
+gensim = pytest.importorskip('gensim')
+from gensim.models.doc2vec import Doc2Vec, TaggedDocument
+
+from train_doc2vec import update_words
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_PATH = os.path.join(PROJECT_DIR, 'model', 'doc2vec.model')
+
+
+def new_documents(words, n_docs=20, seed=1):
+    rng = random.Random(seed)
+    return [TaggedDocument([rng.choice(words) for _ in range(10)], []) for _ in range(n_docs)]
+
+def check_update(model):
+    # 語彙は増え、文書のタグとベクトルはそのまま残り、infer_vector が使える
+    tags = list(model.dv.index_to_key)
+    doc_vectors = model.dv.vectors.copy()
+    old_words = list(model.wv.index_to_key[:20])
+    new_words = ['新しい単語{0}'.format(i) for i in range(5)]
+    corpus = new_documents(old_words + new_words)
+    n_words = len(model.wv)
+
+    update_words(model, corpus)
+    model.train(corpus, total_examples=model.corpus_count, epochs=2)
+
+    assert len(model.wv) == n_words + len(new_words)
+    assert list(model.dv.index_to_key) == tags
+    assert (model.dv.vectors == doc_vectors).all()
+    assert model.dv.get_index(tags[-1]) == len(tags) - 1
+    assert model.infer_vector(new_words).shape == (model.vector_size,)
+
+
+def test_update_words_keeps_doc_vectors():
+    # 元のモデルと同じく、ツイートの番号をタグにして学習したモデル
+    rng = random.Random(0)
+    words = ['単語{0}'.format(i) for i in range(50)]
+    docs = [TaggedDocument([rng.choice(words) for _ in range(10)], [i]) for i in range(100)]
+    model = Doc2Vec(docs, dm=1, vector_size=20, window=8, min_count=2, epochs=2, workers=1)
+    check_update(model)
+
+def test_train_falls_back_on_shipped_model(tmp_path, monkeypatch):
+    # 元の model/doc2vec.model は gensim 3.3 より前の形式で読めないので、最初から学習し直す
+    import train_doc2vec
+    monkeypatch.setattr(train_doc2vec, 'tokenize', lambda text: text.split())
+    model_path = str(tmp_path / 'doc2vec.model')
+    shutil.copy(MODEL_PATH, model_path)
+    tweets_dir = tmp_path / 'tweets'
+    tweets_dir.mkdir()
+    rng = random.Random(0)
+    words = ['単語{0}'.format(i) for i in range(30)]
+    for user in ['alice', 'bob']:
+        lines = [' '.join(rng.choice(words) for _ in range(10)) for _ in range(30)]
+        (tweets_dir / (user + '.txt')).write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+    model = train_doc2vec.train(str(tweets_dir), model_path, workers=1, epochs=1, dedup_threshold=None)
+
+    assert sorted(model.dv.index_to_key) == ['alice', 'bob']
+    assert len(Doc2Vec.load(model_path).dv) == 2
@@ -0,0 +1,162 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+from dedup import DuplicateFilter, exact_hash
+from preprocess import clean_tweet, tokenize
+from recommend import (MODEL_PATH, TWEETS_DIR, file_stamp, is_store_uri, iter_user_tweets, list_users, load_model,
+                       open_store)
+
+
+class TaggedTweets(object):
+    '''
+    ツイートを TaggedDocument(words, [user]) として一件ずつ返す
+    gensim は語彙の構築と学習で何度も読み直すので、__iter__ のたびに最初から読む
+    '''
+
+    def __init__(self, source, users, since_ids=None, dedup_threshold=None, seen=None, tagged=True):
+        self.source = source
+        self.users = users
+        # ストアの時、ユーザーごとにこの id より新しいツイートだけを読む
+        self.since_ids = since_ids or {}
+        # ディレクトリの時、ユーザーごとの学習済みのツイートのハッシュ (これらは読まない)
+        self.seen = seen or {}
+        # 定型文のようなほとんど同じツイートを除く (None で除かない)
+        self.dedup_threshold = dedup_threshold
+        # False なら tags を空にする (既存のモデルの続きの学習では単語だけを学習する)
+        self.tagged = tagged
+
+    def iter_tweets(self, store, user):
+        if store is None:
+            seen = self.seen.get(user, ())
+            return (tweet for tweet in iter_user_tweets(self.source, user) if tweet_hash(tweet) not in seen)
+        tweets = store.findByIdRange(user, since_id=self.since_ids.get(user), fields=['text'])
+        return (clean_tweet(tweet['text']) for tweet in tweets)
+
+    def __iter__(self):
+        from gensim.models.doc2vec import TaggedDocument
+        store = open_store(self.source) if is_store_uri(self.source) else None
+        # 読み直すたびに同じツイートが残るように、毎回新しいフィルタを使う
+        dup = DuplicateFilter(threshold=self.dedup_threshold, k=2) if self.dedup_threshold else None
+        try:
+            for user in self.users:
+                tags = [user] if self.tagged else []
+                for tweet in self.iter_tweets(store, user):
+                    words = tokenize(tweet)
+                    if len(words) == 0 or (dup is not None and dup.is_duplicate(words)):
+                        continue
+                    yield TaggedDocument(words=words, tags=tags)
+        finally:
+            if store is not None:
+                store.close()
+
+
+def tweet_hash(tweet):
+    return exact_hash(tweet)[:8].hex()
+
+def load_state(model_path):
+    # 前回の学習でどこまで読んだか
+    # latest: ユーザーごとの最大の id か、ファイルの更新時刻
+    # seen: ディレクトリの時、ユーザーごとの学習済みのツイートのハッシュ
+    state_path = model_path + '.state.json'
+    if not os.path.exists(state_path):
+        return {'latest': {}, 'seen': {}}
+    with open(state_path) as f:
+        return json.load(f)
+
+def save_state(model_path, state):
+    with open(model_path + '.state.json.tmp', 'w') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(model_path + '.state.json.tmp', model_path + '.state.json')
+
+def current_state(source, users):
+    if is_store_uri(source):
+        store = open_store(source)
+        try:
+            return dict((user, store.maxId(user)) for user in users)
+        finally:
+            store.close()
+    return dict((user, file_stamp(os.path.join(source, user + '.txt'))) for user in users)
+
+def new_corpus(source, state, dedup_threshold=None, tagged=True):
+    # 前回から増えたツイートだけの corpus と、学習後に保存する state を返す
+    users = list_users(source)
+    latest = current_state(source, users)
+    changed = [user for user in users if state['latest'].get(user) != latest[user]]
+    new_state = {'latest': dict(state['latest']), 'seen': dict(state['seen'])}
+    new_state['latest'].update(latest)
+    if is_store_uri(source):
+        return TaggedTweets(source, changed, state['latest'], dedup_threshold, tagged=tagged), new_state
+    # ファイルは書き出し直されるので、学習済みのツイートをハッシュで覚えておいて除く
+    seen = dict((user, set(state['seen'].get(user, ()))) for user in changed)
+    for user in changed:
+        new_state['seen'][user] = sorted(set(tweet_hash(tweet) for tweet in iter_user_tweets(source, user)))
+    return TaggedTweets(source, changed, dedup_threshold=dedup_threshold, seen=seen, tagged=tagged), new_state
+
+def update_words(model, corpus):
+    # 語彙を追加する。文書のタグは増やせない (gensim は dv を広げず、index_to_key を新しいタグで置き換える) ので、
+    # タグの無い文書で単語だけを学習し、既存の文書ベクトルはそのまま残す
+    index_to_key = list(model.dv.index_to_key)
+    model.build_vocab(corpus, update=True)
+    model.dv.index_to_key = index_to_key
+
+def load_previous(model_path):
+    # 続きから学習できるモデル (無い・読めない時は None)
+    if not os.path.exists(model_path):
+        return None
+    try:
+        return load_model(model_path)
+    except ValueError as e:
+        # 元の model/doc2vec.model のように古い gensim で保存されたモデルは、最初から学習し直す
+        print('{0}\ntraining a new model instead (same as --retrain).'.format(e))
+        return None
+
+def train(source=TWEETS_DIR, model_path=MODEL_PATH, workers=None, epochs=None, retrain=False, dedup_threshold=0.9):
+    import gensim
+    from gensim.models.doc2vec import Doc2Vec
+
+    if int(gensim.__version__.split('.')[0]) < 4:
+        raise ValueError('gensim 4 or later is required (found {0})'.format(gensim.__version__))
+    workers = workers or multiprocessing.cpu_count()
+    model = None if retrain else load_previous(model_path)
+    update = model is not None
+    state = load_state(model_path) if update else {'latest': {}, 'seen': {}}
+    corpus, new_state = new_corpus(source, state, dedup_threshold, tagged=not update)
+    if len(corpus.users) == 0:
+        print('no new tweets.')
+        return None
+
+    if update:
+        # 既存のモデルに語彙を追加して、増えたツイートの単語で続きから学習する
+        model.workers = workers
+        update_words(model, corpus)
+        print('continue training {0} ({1} users)'.format(model_path, len(corpus.users)))
+    else:
+        model = Doc2Vec(dm=1, vector_size=300, window=8, min_count=10, workers=workers)
+        model.build_vocab(corpus)
+        print('train new model {0} ({1} users)'.format(model_path, len(corpus.users)))
+    if model.corpus_count > 0:
+        model.train(corpus, total_examples=model.corpus_count, epochs=epochs or model.epochs)
+
+    model.save(model_path)
+    save_state(model_path, new_state)
+    return model
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ツイートでdoc2vecを学習する (既存のモデルがあれば続きから)')
+    parser.add_argument('--source', default=TWEETS_DIR, help='data/tweets のようなディレクトリか、ツイートストアの uri')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--workers', type=int, default=None, help='省略時はCPUのコア数')
+    parser.add_argument('--epochs', type=int, default=None)
+    parser.add_argument('--retrain', action='store_true', help='既存のモデルを使わずに最初から学習する')
+    parser.add_argument('--dedup-threshold', type=float, default=0.9,
+                        help='この値以上似ているツイートを重複として除く (0で除かない)')
+    args = parser.parse_args()
+
+    try:
+        train(args.source, args.model, args.workers, args.epochs, args.retrain, args.dedup_threshold)
+    except ValueError as e:
+        sys.exit('error: {0}'.format(e))
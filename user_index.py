@@ -0,0 +1,187 @@
+import json
+import os
+
+import numpy as np
+
+
+def normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class RandomProjectionLSH(object):
+    '''
+    ランダムな超平面でベクトルをハッシュし、近そうなユーザーの候補を絞る
+    テーブルはバケット番号をソートした配列と、その行番号の配列 (2 x n_tables x 行数) で、そのまま保存できる
+    '''
+
+    def __init__(self, dim, n_bits=16, n_tables=4, seed=0, table=None):
+        self.n_bits = n_bits
+        self.n_tables = n_tables
+        self.seed = seed
+        rng = np.random.RandomState(seed)
+        self.planes = rng.standard_normal((n_tables, n_bits, dim)).astype(np.float32)
+        self.weights = 1 << np.arange(n_bits, dtype=np.int64)
+        self.table = table
+
+    @property
+    def params(self):
+        return {'n_bits': self.n_bits, 'n_tables': self.n_tables, 'seed': self.seed}
+
+    def hash(self, matrix):
+        # (n_tables, len(matrix)) のバケット番号
+        matrix = np.atleast_2d(matrix)
+        projected = matrix.dot(self.planes.reshape(-1, self.planes.shape[2]).T)
+        bits = projected.reshape(len(matrix), self.n_tables, self.n_bits) > 0
+        return bits.dot(self.weights).T
+
+    def build(self, matrix):
+        codes = self.hash(matrix)
+        order = np.argsort(codes, axis=1, kind='stable')
+        self.table = np.stack([np.take_along_axis(codes, order, axis=1), order])
+
+    def candidates(self, query):
+        rows = []
+        for codes, order, code in zip(self.table[0], self.table[1], self.hash(query)[:, 0]):
+            lo = np.searchsorted(codes, code, side='left')
+            hi = np.searchsorted(codes, code, side='right')
+            rows.append(order[lo:hi])
+        return np.unique(np.concatenate(rows)).astype(np.int64)
+
+
+class UserIndex(object):
+    '''
+    正規化した float32 のユーザーベクトルの行列と、行番号→ユーザーの対応表
+    path.npy (memmap で読める) と path.json に保存する
+    '''
+
+    def __init__(self, ids=None, vectors=None, stamps=None):
+        self.ids = list(ids or [])
+        self.rows = dict((user, row) for row, user in enumerate(self.ids))
+        self.vectors = vectors
+        # ユーザーのツイートが変わったかを判定するための値 (ファイルの更新時刻など)
+        self.stamps = dict(stamps or {})
+        self.lsh = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, user):
+        return user in self.rows
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        vectors = np.load(path + '.npy', mmap_mode=mmap_mode)
+        index = cls(meta['ids'], vectors, meta['stamps'])
+        if meta.get('lsh') is not None and os.path.exists(path + '.lsh.npy'):
+            table = np.load(path + '.lsh.npy', mmap_mode=mmap_mode)
+            index.lsh = RandomProjectionLSH(vectors.shape[1], table=table, **meta['lsh'])
+        return index
+
+    def save(self, path, n_bits=16, n_tables=4):
+        # LSH のテーブルもここで作って保存する (検索のたびに作り直さない)
+        # 書き込み途中のファイルを読まれないように、一時ファイルに書いてから置き換える
+        lsh = self.build_lsh(n_bits, n_tables) if len(self) > 0 else None
+        with open(path + '.npy.tmp', 'wb') as f:
+            np.save(f, self.matrix())
+        if lsh is not None:
+            with open(path + '.lsh.npy.tmp', 'wb') as f:
+                np.save(f, lsh.table)
+        with open(path + '.json.tmp', 'w') as f:
+            json.dump({'ids': self.ids, 'stamps': self.stamps, 'lsh': lsh.params if lsh is not None else None},
+                      f, ensure_ascii=False)
+        os.replace(path + '.npy.tmp', path + '.npy')
+        if lsh is not None:
+            os.replace(path + '.lsh.npy.tmp', path + '.lsh.npy')
+        os.replace(path + '.json.tmp', path + '.json')
+
+    def build_lsh(self, n_bits=16, n_tables=4):
+        # 同じ設定のテーブルがあれば使い回す
+        if self.lsh is None or self.lsh.params != {'n_bits': n_bits, 'n_tables': n_tables, 'seed': 0}:
+            self.lsh = RandomProjectionLSH(self.matrix().shape[1], n_bits, n_tables)
+            self.lsh.build(self.matrix())
+        return self.lsh
+
+    def matrix(self):
+        if self.vectors is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self.vectors
+
+    def vector(self, user):
+        return self.vectors[self.rows[user]]
+
+    def stamp(self, user):
+        return self.stamps.get(user)
+
+    def add(self, vectors, stamps=None):
+        # {user: vector} を追加する。既にあるユーザーは行を上書きする
+        if len(vectors) == 0:
+            return
+        users = list(vectors)
+        new_rows = normalize([vectors[user] for user in users])
+        if self.vectors is not None and self.matrix().shape[1] != new_rows.shape[1]:
+            # vector_size を変えて学習し直したモデルのベクトルとは比べられないので、今回のベクトルだけで作り直す
+            self.remove([user for user in self.ids if user not in vectors])
+            self.ids = []
+            self.rows = {}
+            self.vectors = None
+        if self.vectors is None:
+            matrix = np.zeros((0, new_rows.shape[1]), dtype=np.float32)
+        else:
+            # memmap は読み込み専用なのでコピーしてから書き換える
+            matrix = np.array(self.vectors, dtype=np.float32)
+        appended = []
+        for user, vector in zip(users, new_rows):
+            if user in self.rows:
+                matrix[self.rows[user]] = vector
+            else:
+                self.rows[user] = len(self.ids)
+                self.ids.append(user)
+                appended.append(vector)
+        if len(appended) > 0:
+            matrix = np.vstack([matrix, np.array(appended, dtype=np.float32)])
+        self.vectors = matrix
+        self.stamps.update(stamps or {})
+        self.lsh = None
+
+    def remove(self, users):
+        # ベクトルの無いユーザーの stamp も消す
+        for user in users:
+            self.stamps.pop(user, None)
+        users = [user for user in users if user in self.rows]
+        if len(users) == 0:
+            return
+        drop = set(users)
+        keep = [row for row, user in enumerate(self.ids) if user not in drop]
+        self.vectors = np.array(self.matrix()[keep], dtype=np.float32)
+        self.ids = [self.ids[row] for row in keep]
+        self.rows = dict((user, row) for row, user in enumerate(self.ids))
+        self.lsh = None
+
+    def search(self, query, topn=5, exclude=(), approximate=False, n_bits=16, n_tables=4):
+        # query とのコサイン類似度が高い順に (user, 類似度) を返す
+        if len(self) == 0:
+            return []
+        query = normalize(query)
+        matrix = self.matrix()
+        rows = None
+        if approximate:
+            rows = self.build_lsh(n_bits, n_tables).candidates(query)
+            # 候補が少なすぎる時は全件から探す
+            if len(rows) < topn + len(exclude):
+                rows = None
+        if rows is None:
+            sims = matrix.dot(query)
+            rows = np.arange(len(sims))
+        else:
+            sims = matrix[rows].dot(query)
+        excluded = set(self.rows[user] for user in exclude if user in self.rows)
+        k = min(topn + len(excluded), len(sims))
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        results = [(self.ids[rows[i]], float(sims[i])) for i in top if rows[i] not in excluded]
+        return results[:topn]
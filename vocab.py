@@ -0,0 +1,84 @@
+import collections
+import hashlib
+
+import numpy as np
+
+
+def token_hash(token):
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def vocab_fingerprint(dic):
+    # 単語→id の対応のハッシュ。同じ対応なら gensim の Dictionary でも ServingVocab でも同じ値になる
+    if isinstance(dic, ServingVocab):
+        table = np.asarray(dic.table)
+    else:
+        items = sorted(dic.token2id.items())
+        table = np.array([[token_hash(token) for token, _ in items],
+                          [word_id for _, word_id in items]], dtype=np.uint64).reshape(2, -1)
+        table = table[:, np.argsort(table[0], kind='stable')]
+    return hashlib.sha1(np.ascontiguousarray(table).tobytes()).hexdigest()[:16]
+
+def read_dic_text(dic_path):
+    # gensim の Dictionary.save_as_text の形式 (id, 単語, 文書頻度) を読む
+    entries = []
+    with open(dic_path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 3:
+                # 新しい gensim は先頭に文書数だけの行がある
+                continue
+            entries.append((int(fields[0]), fields[1], int(fields[2])))
+    return entries
+
+
+class ServingVocab(object):
+    '''
+    推論用の読み込み専用の語彙 (単語→id の引き当てだけ)
+    単語の 64bit ハッシュをソートした配列と id の配列を 1 つの .npy (2 x 語彙数) にまとめ、memmap で読む
+    gensim の Dictionary の代わりに doc2bow と len() が使える
+    '''
+
+    def __init__(self, table):
+        self.table = table
+        self.hashes = table[0]
+        self.ids = table[1]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, dic_path, top_n=None, min_df=None):
+        # top_n, min_df で語彙を絞った時は、id を 0 から詰め直す (モデルの入力の次元が減る)
+        entries = read_dic_text(dic_path)
+        pruned = top_n is not None or min_df is not None
+        if min_df is not None:
+            entries = [entry for entry in entries if entry[2] >= min_df]
+        if top_n is not None:
+            entries = sorted(entries, key=lambda entry: (-entry[2], entry[0]))[:top_n]
+        entries = sorted(entries)
+        if pruned:
+            entries = [(new_id, token, df) for new_id, (_, token, df) in enumerate(entries)]
+        table = np.array([[token_hash(token) for _, token, _ in entries],
+                          [word_id for word_id, _, _ in entries]], dtype=np.uint64).reshape(2, -1)
+        order = np.argsort(table[0], kind='stable')
+        return cls(np.ascontiguousarray(table[:, order]))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        return cls(np.load(path, mmap_mode='r' if mmap else None))
+
+    def save(self, path):
+        np.save(path, self.table)
+
+    def lookup(self, tokens):
+        # 単語ごとの id (無い単語は -1)
+        if len(tokens) == 0 or len(self) == 0:
+            return np.full(len(tokens), -1, dtype=np.int64)
+        hashes = np.fromiter((token_hash(token) for token in tokens), dtype=np.uint64, count=len(tokens))
+        pos = np.minimum(np.searchsorted(self.hashes, hashes), len(self) - 1)
+        found = self.hashes[pos] == hashes
+        return np.where(found, self.ids[pos].astype(np.int64), -1)
+
+    def doc2bow(self, words):
+        counts = collections.Counter(int(word_id) for word_id in self.lookup(words) if word_id >= 0)
+        return sorted(counts.items())